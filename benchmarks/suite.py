@@ -0,0 +1,298 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from multiprocessing import get_context
+
+import numba
+import numpy as np
+
+import monitoring.decorators
+from calculation.arbitrary_mapping import populate_2d_points
+from calculation.cr_set_localizing import condense_connected_components
+from monitoring.decorators import record_metrics
+from settings.managing import SETTINGS_BY_MODES, resolve_mode_settings
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Bumped whenever the layout of the results changes; results of different
+# versions are not compared
+RESULTS_FORMAT_VERSION = 1
+RESULTS_DIRECTORY = os.path.join('benchmarks', 'results')
+BASELINE_PATH = os.path.join('benchmarks', 'baseline.json')
+
+# Mappings of the shipped presets, run in both modes
+PRESETS = {
+    'henon': 'ARBITRARY_MAPPING',
+    'ikeda': 'CR_SET_LOCALIZING',
+}
+ITERATIONS_LADDER = (10**4, 10**5, 10**6, 10**7, 10**8)
+DEPTH_LADDER = (3, 4, 5, 6, 7, 8)
+LOCALIZATION_SEED = 0
+DEFAULT_REPEATS = 3
+
+# Throughputs falling, or peak memory growing, by more than the tolerance
+# relative to the baseline are reported as regressions
+DEFAULT_TOLERANCE = .1
+THROUGHPUT_METRICS = ('points_per_second', 'cells_per_second',
+                      'edges_per_second')
+MEMORY_METRIC = 'peak_rss_mb'
+
+
+def _get_mappings(preset):
+    settings = resolve_mode_settings(PRESETS[preset], {})
+    return settings['x_mapping'], settings['y_mapping']
+
+
+def _run_orbit(preset, iterations, graph_backend):
+
+    x_mapping, y_mapping = _get_mappings(preset)
+    populate_2d_points(x_mapping, y_mapping,
+                       SETTINGS_BY_MODES['ARBITRARY_MAPPING']['start_point'],
+                       iterations)
+
+    return {'points': iterations + 1}
+
+
+def _run_localization(preset, depth, graph_backend):
+
+    x_mapping, y_mapping = _get_mappings(preset)
+    settings = SETTINGS_BY_MODES['CR_SET_LOCALIZING']
+    condense_connected_components(
+        x_mapping, y_mapping, (*settings['sw_point'], *settings['ne_point']),
+        settings['cell_density'], depth, settings['topsort_enabled'],
+        graph_backend=graph_backend, seed=LOCALIZATION_SEED)
+
+    totals = {'points': 0, 'cells': 0, 'edges': 0}
+    for stage in monitoring.decorators.last_metrics['stages']:
+        if stage['name'] == 'symbolic_image':
+            totals['points'] += stage.get('sample_points', 0)
+            totals['cells'] += stage['cells']
+            totals['edges'] += stage['edges']
+
+    return totals
+
+
+MODE_RUNNERS = {
+    'ARBITRARY_MAPPING': (_run_orbit, ITERATIONS_LADDER),
+    'CR_SET_LOCALIZING': (_run_localization, DEPTH_LADDER),
+}
+
+
+def _initialize_worker():
+    monitoring.decorators.PROFILING_RATE = 0.0
+    monitoring.decorators.METRICS_DUMP_PATH = None
+
+
+def _run_case(task):
+    """
+    Runs one case in a fresh process, so that its peak memory isn't
+    affected by the others. The smallest size of the ladder is run first to
+    load compiled kernels, the best of `repeats` timed runs is reported.
+    """
+    preset, mode, size, repeats, graph_backend = task
+    runner, ladder = MODE_RUNNERS[mode]
+    measured_runner = record_metrics(runner)
+
+    measured_runner(preset, ladder[0], graph_backend)
+
+    runs = []
+    for _ in range(repeats):
+        counts = measured_runner(preset, size, graph_backend)
+        runs.append((monitoring.decorators.last_metrics, counts))
+
+    metrics, counts = min(runs, key=lambda x: x[0]['wall_time'])
+    case = {
+        'preset': preset,
+        'mode': mode,
+        'size': size,
+        'wall_time': metrics['wall_time'],
+        'cpu_time': metrics['cpu_time'],
+        # Peak of the whole process, which runs this case only
+        MEMORY_METRIC: metrics['process_peak_rss_mb'],
+        **counts,
+    }
+    for count in ('points', 'cells', 'edges'):
+        if count in counts:
+            case[f'{count}_per_second'] = counts[count] / metrics['wall_time']
+
+    return case
+
+
+def build_cases(presets, max_iterations, max_depth):
+
+    limits = {'ARBITRARY_MAPPING': max_iterations,
+              'CR_SET_LOCALIZING': max_depth}
+
+    return [(preset, mode, size)
+            for preset in presets
+            for mode, (_, ladder) in MODE_RUNNERS.items()
+            for size in ladder if size <= limits[mode]]
+
+
+def _get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(cases, repeats=DEFAULT_REPEATS, graph_backend='sparse'):
+    """
+    Runs the (preset, mode, size) `cases` one process at a time and returns
+    the results along with the environment they were obtained in.
+    """
+    tasks = [(*case, repeats, graph_backend) for case in cases]
+
+    # Spawned rather than forked, so that no memory is inherited
+    with get_context('spawn').Pool(1, _initialize_worker,
+                                   maxtasksperchild=1) as pool:
+        results = []
+        for case in pool.imap(_run_case, tasks):
+            logging.info(f'{case["preset"]} {case["mode"]} '
+                         f'{case["size"]}: {case["wall_time"]:.3f} sec')
+            results.append(case)
+
+    return {
+        'version': RESULTS_FORMAT_VERSION,
+        'revision': _get_revision(),
+        'created_at': datetime.now().isoformat(),
+        'environment': {
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba.__version__,
+        },
+        'settings': {'repeats': repeats, 'graph_backend': graph_backend},
+        'cases': results,
+    }
+
+
+def _get_case_key(case):
+    return case['preset'], case['mode'], case['size']
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the cases present in both `results` and `baseline`. Returns a
+    list of (case key, metric, baseline value, current value) of throughputs
+    dropped, or peak memory grown, by more than `tolerance`.
+    """
+    if baseline['version'] != results['version']:
+        logging.error(f'Baseline results of version {baseline["version"]} '
+                      f'cannot be compared to version {results["version"]}')
+        raise ValueError
+
+    if baseline['settings'] != results['settings']:
+        logging.warning('Baseline was obtained with different settings: '
+                        f'{baseline["settings"]}')
+
+    reference_cases = {_get_case_key(x): x for x in baseline['cases']}
+    regressions = []
+
+    for case in results['cases']:
+
+        reference = reference_cases.get(_get_case_key(case))
+        if reference is None:
+            continue
+
+        for metric in THROUGHPUT_METRICS:
+            if metric in case and metric in reference \
+                    and case[metric] < reference[metric] * (1 - tolerance):
+                regressions.append((_get_case_key(case), metric,
+                                    reference[metric], case[metric]))
+
+        if case[MEMORY_METRIC] is not None \
+                and reference[MEMORY_METRIC] is not None \
+                and case[MEMORY_METRIC] \
+                > reference[MEMORY_METRIC] * (1 + tolerance):
+            regressions.append((_get_case_key(case), MEMORY_METRIC,
+                                reference[MEMORY_METRIC], case[MEMORY_METRIC]))
+
+    return regressions
+
+
+def save_results(results, path):
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+
+    logging.info(f'Results are saved to {path}')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(
+        description='Runs both modes on the shipped presets across a ladder '
+                    'of sizes and checks the results against a baseline.')
+    parser.add_argument('--presets', nargs='+', choices=list(PRESETS),
+                        default=list(PRESETS), help='presets to run')
+    parser.add_argument('--max-iterations', type=int,
+                        default=ITERATIONS_LADDER[-1],
+                        help='largest orbit length of the ladder to run')
+    parser.add_argument('--max-depth', type=int, default=DEPTH_LADDER[-1],
+                        help='largest localization depth of the ladder to run')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help='timed runs per case, the best one is kept')
+    parser.add_argument('--graph-backend', choices=('networkx', 'sparse'),
+                        default='sparse',
+                        help='component graph backend of localization')
+    parser.add_argument('--output', metavar='PATH',
+                        help='results file, by default a new file under '
+                             f'`{RESULTS_DIRECTORY}`')
+    parser.add_argument('--baseline', metavar='PATH', default=BASELINE_PATH,
+                        help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative change reported as a regression')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    results = run_benchmarks(
+        build_cases(arguments.presets, arguments.max_iterations,
+                    arguments.max_depth),
+        arguments.repeats, arguments.graph_backend)
+
+    save_results(results, arguments.output or os.path.join(
+        RESULTS_DIRECTORY,
+        f'{datetime.now():%Y%m%d-%H%M%S}-{results["revision"]}.json'))
+
+    if arguments.update_baseline:
+        save_results(results, arguments.baseline)
+        sys.exit(0)
+
+    if not os.path.exists(arguments.baseline):
+        logging.warning(f'No baseline found at {arguments.baseline}, run with '
+                        '--update-baseline to create one')
+        sys.exit(0)
+
+    with open(arguments.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    try:
+        regressions = find_regressions(results, baseline, arguments.tolerance)
+    except ValueError:
+        logging.error('Aborting regression check...')
+        sys.exit(1)
+
+    for (preset, mode, size), metric, expected, actual in regressions:
+        logging.error(f'Regression in {preset} {mode} {size}: {metric} is '
+                      f'{actual:.4g} against {expected:.4g} in the baseline')
+
+    logging.info(f'{len(regressions)} regressions found')
+    sys.exit(1 if regressions else 0)
@@ -1,15 +1,26 @@
+import json
 import logging
+import os
 
 import numpy as np
-from tqdm import trange
+from numpy.lib.format import open_memmap
+from tqdm import tqdm, trange
 
+from calculation.compiled_mapping import get_orbit_kernel, \
+    supports_compilation
+from calculation.model.symbolic_function import evaluate_on_arrays
 from monitoring.decorators import capture_execution_time, dump_profile
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+SUPPORTED_DTYPES = (np.float32, np.float64)
+DEFAULT_CHUNK_SIZE = 1_000_000
+ORBIT_CACHE_POINTS_FILE = 'points.npy'
+ORBIT_CACHE_STATE_FILE = 'state.json'
 
-def _validate_args(x_mapping, y_mapping, start_point, iterations):
+
+def _validate_args(x_mapping, y_mapping, start_point, iterations, dtype):
 
     if not callable(x_mapping):
         logging.error(f'`x_mapping` ({x_mapping}) is not a callable object; '
@@ -33,30 +44,270 @@ def _validate_args(x_mapping, y_mapping, start_point, iterations):
                       'pass positive integer instead')
         raise ValueError
 
+    if dtype not in SUPPORTED_DTYPES:
+        logging.error(f'Unsupported `dtype` given: {dtype}; '
+                      'pass either numpy.float32 or numpy.float64')
+        raise ValueError
+
+
+def _validate_batch_args(x_mapping, y_mapping, start_points, iterations,
+                         dtype):
+
+    _validate_args(x_mapping, y_mapping, (.0, .0), iterations, dtype)
+
+    if start_points.ndim != 2 \
+            or start_points.shape[0] < 1 \
+            or start_points.shape[1] != 2:
+        logging.error('Incorrect `start_points` shape: '
+                      f'{start_points.shape}; must be (N, 2) with N > 0')
+        raise ValueError
+
+
+def _validate_chunk_size(chunk_size):
+
+    if chunk_size < 1:
+        logging.error(f'Invalid `chunk_size` number given: {chunk_size}; '
+                      'pass positive integer instead')
+        raise ValueError
+
+
+def _get_orbit_advancer(x_mapping, y_mapping, compiled, dtype, length,
+                        range_factory=range):
+
+    kernel = get_orbit_kernel(x_mapping, y_mapping, dtype, length) \
+        if compiled else None
+
+    if kernel is not None:
+        return lambda state, points: kernel(*state, points)
+
+    def advance_interpreted(state, points):
+
+        x, y = state
+        for i in range_factory(points.shape[0]):
+            x, y = x_mapping(x, y), y_mapping(x, y)
+            points[i] = x, y
+
+        return x, y
+
+    return advance_interpreted
+
+
+def _fill_orbit_chunks(advance, start_point, chunks):
+    """
+    Writes the orbit into consecutive `chunks` buffers, the first one
+    starting with `start_point` itself. Only the current (x, y) state is
+    carried between chunks, in double precision.
+    """
+    state = tuple(start_point)
+
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            chunk[0] = state
+            state = advance(state, chunk[1:])
+        else:
+            state = advance(state, chunk)
+
+        yield chunk
+
+
+def _read_cached_orbit(entry, points):
+    """
+    Copies the cached orbit prefix into `points`. Returns the number of
+    points copied and, if the whole cached orbit was used, the state to
+    continue it from.
+    """
+    state_path = os.path.join(entry, ORBIT_CACHE_STATE_FILE)
+    if not os.path.exists(state_path):
+        return 0, None
+
+    with open(state_path) as f:
+        cached_state = json.load(f)
+
+    cached = load_2d_points(os.path.join(entry, ORBIT_CACHE_POINTS_FILE))
+    if cached.shape[0] != cached_state['length']:
+        return 0, None
+
+    copied = min(cached.shape[0], points.shape[0])
+    points[:copied] = cached[:copied]
+
+    return copied, tuple(cached_state['state']) \
+        if copied == cached.shape[0] else None
+
+
+def _write_cached_orbit(entry, points, state):
+
+    points_path = os.path.join(entry, ORBIT_CACHE_POINTS_FILE)
+    state_path = os.path.join(entry, ORBIT_CACHE_STATE_FILE)
+
+    np.save(f'{points_path}.tmp.npy', points)
+    os.replace(f'{points_path}.tmp.npy', points_path)
+
+    with open(f'{state_path}.tmp', 'w') as f:
+        json.dump({'length': points.shape[0], 'state': list(state)}, f)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+def _split_into_chunks(total, chunk_size):
+    for offset in range(0, total, chunk_size):
+        yield offset, min(chunk_size, total - offset)
+
 
 @dump_profile
 @capture_execution_time
 def populate_2d_points(x_mapping, y_mapping, start_point=(.0, .0),
-                       iterations=100):
+                       iterations=100, compiled=True, dtype=np.float32,
+                       cache=None):
+    """
+    Returns the orbit of `start_point` as one interleaved (iterations + 1, 2)
+    array. Use float64 `dtype` for chaotic maps where rounding of the stored
+    points matters; the orbit itself is always iterated in double precision.
 
+    Given a `ResultCache`, orbits of parsed mappings are looked up there
+    first; a cached shorter orbit is extended rather than recomputed.
+    """
     try:
-        _validate_args(x_mapping, y_mapping, start_point, iterations)
+        _validate_args(x_mapping, y_mapping, start_point, iterations, dtype)
     except ValueError:
         logging.error('Aborting arbitrary mapping construction...')
         return None
 
-    xs_array = np.empty(iterations + 1, dtype=np.float32)
-    ys_array = np.empty(iterations + 1, dtype=np.float32)
+    points = np.empty((iterations + 1, 2), dtype=dtype)
+    computed, state = 0, tuple(start_point)
+    entry = None
+
+    if cache is not None and supports_compilation(x_mapping, y_mapping):
+        entry = cache.get_entry(
+            'orbit', x_mapping=x_mapping, y_mapping=y_mapping,
+            start_point=tuple(start_point),
+            compiled=compiled, dtype=np.dtype(dtype).name)
+        computed, cached_state = _read_cached_orbit(entry, points)
+        state = cached_state or state
+        logging.info(f'{computed} points are taken from the cache')
+
+    if computed < points.shape[0]:
 
-    x, y = start_point
+        if computed == 0:
+            points[0] = state
+            computed = 1
 
-    # TODO try to store everything in one array to grab as more elements 
-    # as possible per cache line
-    xs_array[0], ys_array[0] = x, y
+        advance = _get_orbit_advancer(x_mapping, y_mapping, compiled, dtype,
+                                      points.shape[0] - computed,
+                                      range_factory=trange)
+        state = advance(state, points[computed:])
 
-    for i in trange(iterations):
-        x, y = x_mapping(x, y), y_mapping(x, y)
-        xs_array[i + 1], ys_array[i + 1] = x, y
+        if entry is not None:
+            _write_cached_orbit(entry, points, state)
+            cache.evict(keep=entry)
 
     logging.info('The mapping is ready')
-    return xs_array, ys_array
+    return points
+
+
+def stream_2d_points(x_mapping, y_mapping, start_point=(.0, .0),
+                     iterations=100, chunk_size=DEFAULT_CHUNK_SIZE,
+                     compiled=True, dtype=np.float32):
+    """
+    Generator version of `populate_2d_points`: yields the same orbit as
+    consecutive (chunk_size, 2) arrays, so that only one chunk has to be
+    kept in memory at a time.
+    """
+    try:
+        _validate_args(x_mapping, y_mapping, start_point, iterations, dtype)
+        _validate_chunk_size(chunk_size)
+    except ValueError:
+        logging.error('Aborting arbitrary mapping streaming...')
+        return
+
+    advance = _get_orbit_advancer(x_mapping, y_mapping, compiled, dtype,
+                                  iterations + 1)
+    chunks = (np.empty((size, 2), dtype=dtype) for _, size
+              in _split_into_chunks(iterations + 1, chunk_size))
+
+    with tqdm(total=iterations + 1) as progress:
+        for chunk in _fill_orbit_chunks(advance, start_point, chunks):
+            progress.update(chunk.shape[0])
+            yield chunk
+
+
+@dump_profile
+@capture_execution_time
+def dump_2d_points(path, x_mapping, y_mapping, start_point=(.0, .0),
+                   iterations=100, chunk_size=DEFAULT_CHUNK_SIZE,
+                   compiled=True, dtype=np.float32):
+    """
+    Writes the orbit chunk by chunk into a memory-mapped `.npy` file at
+    `path`, so the orbit length is bounded by disk space rather than RAM.
+    Returns the read-only memory map of the written file.
+    """
+    try:
+        _validate_args(x_mapping, y_mapping, start_point, iterations, dtype)
+        _validate_chunk_size(chunk_size)
+    except ValueError:
+        logging.error('Aborting arbitrary mapping dump...')
+        return None
+
+    advance = _get_orbit_advancer(x_mapping, y_mapping, compiled, dtype,
+                                  iterations + 1)
+    points = open_memmap(path, mode='w+', dtype=dtype,
+                         shape=(iterations + 1, 2))
+    chunks = (np.asarray(points[offset:offset + size]) for offset, size
+              in _split_into_chunks(iterations + 1, chunk_size))
+
+    for _ in tqdm(_fill_orbit_chunks(advance, start_point, chunks),
+                  total=-(-(iterations + 1) // chunk_size)):
+        pass
+
+    points.flush()
+    del points
+
+    logging.info(f'The mapping is dumped to {path}')
+    return load_2d_points(path)
+
+
+def load_2d_points(path):
+    return np.load(path, mmap_mode='r')
+
+
+def iterate_2d_points_batch(x_mapping, y_mapping, start_points, iterations):
+    """
+    Advance all orbits of `start_points` together, yielding an (N, 2)
+    array of current positions per step (the start points included).
+    Diverged orbits turn into inf/nan instead of raising.
+    """
+    xs = np.array(start_points[:, 0], dtype=np.float64)
+    ys = np.array(start_points[:, 1], dtype=np.float64)
+    yield np.column_stack((xs, ys))
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        for _ in trange(iterations):
+            xs, ys = evaluate_on_arrays(x_mapping, xs, ys), \
+                evaluate_on_arrays(y_mapping, xs, ys)
+            yield np.column_stack((xs, ys))
+
+
+@dump_profile
+@capture_execution_time
+def populate_2d_points_batch(x_mapping, y_mapping, start_points,
+                             iterations=100, dtype=np.float32):
+    """
+    Vectorized counterpart of `populate_2d_points` for many seeds at once.
+    Returns an array of shape (N, iterations + 1, 2).
+    """
+    start_points = np.asarray(start_points, dtype=np.float64)
+
+    try:
+        _validate_batch_args(x_mapping, y_mapping, start_points, iterations,
+                             dtype)
+    except ValueError:
+        logging.error('Aborting batched arbitrary mapping construction...')
+        return None
+
+    points = np.empty((start_points.shape[0], iterations + 1, 2),
+                      dtype=dtype)
+
+    for i, step_points in enumerate(iterate_2d_points_batch(
+            x_mapping, y_mapping, start_points, iterations)):
+        points[:, i] = step_points
+
+    logging.info(f'The mapping is ready for {points.shape[0]} trajectories')
+    return points
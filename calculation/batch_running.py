@@ -0,0 +1,277 @@
+import itertools
+import json
+import logging
+import os
+import platform
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+import monitoring.decorators
+from calculation.model.localization_result import LocalizationResult
+from calculation.result_cache import ResultCache
+from settings.managing import resolve_mode_settings
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+JOB_DIRECTORY_FORMAT = 'job_{:05d}'
+JOB_POINTS_FILE = 'points.npy'
+JOB_CELLS_FILE = 'cells.npz'
+JOB_LAYERS_FILE = 'layers.gif'
+JOB_RASTER_FILE = 'points{}'
+JOB_METADATA_FILE = 'metadata.json'
+BATCH_SUMMARY_FILE = 'summary.json'
+
+
+# Modes (and rasterization) import their modules on first use, so that short
+# jobs don't pay for loading libraries they never call
+
+def _run_arbitrary_mapping(settings):
+
+    from calculation.arbitrary_mapping import populate_2d_points
+
+    return populate_2d_points(
+        settings.pop('x_mapping'),
+        settings.pop('y_mapping'),
+        settings.pop('start_point'),
+        settings.pop('iterations'),
+        **settings
+    )
+
+
+def _run_cr_set_localizing(settings):
+
+    from calculation.cr_set_localizing import condense_connected_components
+
+    return condense_connected_components(
+        settings.pop('x_mapping'),
+        settings.pop('y_mapping'),
+        (*settings.pop('sw_point'), *settings.pop('ne_point')),
+        settings.pop('cell_density'),
+        settings.pop('depth'),
+        settings.pop('topsort_enabled'),
+        **settings
+    )
+
+
+MODE_RUNNERS = {
+    'ARBITRARY_MAPPING': _run_arbitrary_mapping,
+    'CR_SET_LOCALIZING': _run_cr_set_localizing,
+}
+
+
+def parse_grid(specification):
+    """
+    Parses a sweep grid given as `name=start:stop:count` (evenly spaced,
+    both ends included) or `name=v1,v2,...`. Returns (name, values).
+    """
+    name, _, values = specification.partition('=')
+
+    if not name.isidentifier() or not values:
+        logging.error(f'Invalid grid given: {specification}; pass '
+                      '`name=start:stop:count` or `name=v1,v2,...` instead')
+        raise ValueError
+
+    try:
+        if ':' in values:
+            start, stop, count = values.split(':')
+            return name, np.linspace(float(start), float(stop),
+                                     int(count)).tolist()
+
+        return name, [float(x) for x in values.split(',')]
+
+    except ValueError:
+        logging.error(f'Invalid grid values given: {values}')
+        raise
+
+
+def build_jobs(parameters, grids):
+    """
+    Returns the list of parameter dicts: `parameters` combined with every
+    point of the Cartesian product of `grids`.
+    """
+    names = list(grids)
+    return [{**parameters, **dict(zip(names, point))}
+            for point in itertools.product(*grids.values())]
+
+
+def _is_completed(metadata_path, mode, settings, parameters):
+
+    if not os.path.exists(metadata_path):
+        return False
+
+    with open(metadata_path, encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    # Comparing through JSON, as tuples are stored as lists
+    return metadata['status'] == 'ok' and metadata['mode'] == mode \
+        and metadata['settings'] == json.loads(json.dumps(settings)) \
+        and metadata['parameters'] == parameters
+
+
+def _run_job(task):
+
+    index, mode, settings, parameters, output_dir, raster, cache_path = task
+
+    directory = os.path.join(output_dir, JOB_DIRECTORY_FORMAT.format(index))
+    metadata_path = os.path.join(directory, JOB_METADATA_FILE)
+
+    if _is_completed(metadata_path, mode, settings, parameters):
+        logging.info(f'Job {index} is already completed, skipping...')
+        with open(metadata_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    metadata = {
+        'index': index,
+        'mode': mode,
+        'settings': settings,
+        'parameters': parameters,
+        'host': platform.node(),
+        'started_at': datetime.now().isoformat(),
+    }
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    monitoring.decorators.last_metrics = None
+
+    try:
+        resolved = resolve_mode_settings(mode, settings, parameters)
+        if 'dtype' in resolved:
+            resolved['dtype'] = getattr(np, resolved['dtype'])
+        if cache_path is not None:
+            resolved['cache'] = ResultCache(cache_path)
+
+        result = MODE_RUNNERS[mode](resolved)
+
+    except Exception as e:
+        # Any error of a single job, the numerical ones of the mapping
+        # included, fails only that job rather than the whole batch
+        logging.exception(f'Job {index} failed: {e!r}')
+        metadata['error'] = repr(e)
+        result = None
+
+    metadata['wall_time'] = time.perf_counter() - wall_start
+    metadata['cpu_time'] = time.process_time() - cpu_start
+    metadata['finished_at'] = datetime.now().isoformat()
+    metadata['metrics'] = monitoring.decorators.last_metrics
+
+    os.makedirs(directory, exist_ok=True)
+
+    if result is None:
+        metadata['status'] = 'failed'
+
+    elif isinstance(result, LocalizationResult):
+        np.savez(os.path.join(directory, JOB_CELLS_FILE),
+                 **result.to_arrays())
+        if raster is not None:
+            from visualization.raster import save_cells_raster
+
+            extension, resolution = raster
+            save_cells_raster(
+                os.path.join(directory, JOB_RASTER_FILE.format(extension)),
+                result.bounds, result.clusters, resolution=resolution)
+
+        if result.layers:
+            from visualization.raster import DEFAULT_RESOLUTION, \
+                save_layers_gif
+
+            save_layers_gif(os.path.join(directory, JOB_LAYERS_FILE), result,
+                            raster[1] if raster else DEFAULT_RESOLUTION)
+
+        metadata['status'] = 'ok'
+        metadata['cells_number'] = len(result)
+        metadata['clusters_number'] = result.clusters_number
+
+    else:
+        np.save(os.path.join(directory, JOB_POINTS_FILE), result)
+        if raster is not None:
+            from visualization.raster import save_raster
+
+            extension, resolution = raster
+            save_raster(
+                os.path.join(directory, JOB_RASTER_FILE.format(extension)),
+                result, resolution=resolution)
+
+        metadata['status'] = 'ok'
+        metadata['points_number'] = len(result)
+
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=4)
+
+    return metadata
+
+
+def _initialize_worker(profiling_enabled):
+    monitoring.decorators.PROFILING_RATE = 1.0 if profiling_enabled else 0.0
+    # Stage metrics go into the job metadata instead of files of their own
+    monitoring.decorators.METRICS_DUMP_PATH = None
+
+
+def run_batch(mode, settings, parameters, grids, output_dir, workers=1,
+              profiling_enabled=False, raster_format=None,
+              raster_resolution=None, cache_path=None):
+    """
+    Runs `mode` for every parameter combination of `grids` across a pool of
+    `workers` processes. Every job writes its points and timing metadata
+    into a directory of its own under `output_dir`, stage metrics included;
+    jobs already completed with the same inputs are skipped, so an
+    interrupted batch can simply be restarted. With `raster_format` (one of
+    RASTER_FORMATS) given, every job also renders its points into an image
+    of `raster_resolution` (DEFAULT_RESOLUTION if not given). With
+    `cache_path` given, jobs reuse and store their results in the
+    `ResultCache` at that directory. Returns the list of job metadata dicts.
+    """
+    if mode not in MODE_RUNNERS:
+        logging.error(f'Unknown mode given: {mode}; '
+                      f'pass one of {", ".join(MODE_RUNNERS)}')
+        raise ValueError
+
+    if workers > 1 and settings.get('workers', 1) > 1:
+        logging.error('Jobs of a parallel batch cannot spawn processes of '
+                      'their own; set either `workers` setting or batch '
+                      'workers to 1')
+        raise ValueError
+
+    raster = None
+    if raster_format is not None:
+        from visualization.raster import DEFAULT_RESOLUTION, RASTER_FORMATS
+
+        if raster_format not in RASTER_FORMATS:
+            logging.error(f'Unsupported raster format given: {raster_format}; '
+                          f'pass one of {", ".join(RASTER_FORMATS)}')
+            raise ValueError
+
+        raster = (raster_format, raster_resolution or DEFAULT_RESOLUTION)
+
+    jobs = build_jobs(parameters, grids)
+    tasks = [(index, mode, settings, job, output_dir, raster, cache_path)
+             for index, job in enumerate(jobs)]
+    logging.info(f'Running {len(tasks)} jobs on {workers} workers...')
+
+    os.makedirs(output_dir, exist_ok=True)
+    batch_start = time.perf_counter()
+
+    if workers > 1:
+        with Pool(workers, _initialize_worker, (profiling_enabled, )) as pool:
+            results = list(tqdm(pool.imap_unordered(_run_job, tasks),
+                                total=len(tasks)))
+    else:
+        _initialize_worker(profiling_enabled)
+        results = [_run_job(task) for task in tqdm(tasks)]
+
+    results.sort(key=lambda x: x['index'])
+    failed = sum(1 for x in results if x['status'] != 'ok')
+
+    with open(os.path.join(output_dir, BATCH_SUMMARY_FILE), 'w',
+              encoding='utf-8') as f:
+        json.dump({
+            'mode': mode,
+            'grids': grids,
+            'wall_time': time.perf_counter() - batch_start,
+            'jobs': results,
+        }, f, indent=4)
+
+    logging.info(f'{len(results) - failed} jobs succeeded, {failed} failed')
+    return results
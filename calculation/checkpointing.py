@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from calculation.model.symbolic_function import SymbolicFunction
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Layers are named after (a prefix of) the fingerprint of their run, so
+# that runs of different settings can share a checkpoint directory
+LAYER_FILE_FORMAT = 'layer_{}_{:02d}.npz'
+LAYER_FILE_REGEX = r'layer_([0-9a-f]+)_(\d+)\.npz'
+FINGERPRINT_PREFIX_LENGTH = 16
+
+
+def compute_fingerprint(**parameters):
+    """
+    Stable hash of everything that affects the localization layers, used to
+    tell whether a stored layer can be reused for the current run. Mappings
+    are hashed in their canonical form, so equivalent inputs like
+    `.3 * y + 1` and `1 + 0.3*y` give the same fingerprint.
+    """
+    canonical = json.dumps({
+        key: value.canonical if isinstance(value, SymbolicFunction)
+        else repr(value)
+        for key, value in parameters.items()
+    }, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def get_layer_path(directory, fingerprint, level):
+    return os.path.join(directory, LAYER_FILE_FORMAT.format(
+        fingerprint[:FINGERPRINT_PREFIX_LENGTH], level))
+
+
+def save_layer(directory, fingerprint, area, component_graph):
+    """
+    Stores the cell grid state of `area` after a completed layer along with
+    the SCC summary of its graph. The file is written under a temporary name
+    first, so that an interrupted run never leaves a truncated checkpoint.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = get_layer_path(directory, fingerprint, area.level)
+    temporary_path = f'{path}.tmp.npz'
+
+    np.savez(temporary_path, fingerprint=np.array(fingerprint),
+             scc_sizes=component_graph.scc_sizes, **area.get_state())
+    os.replace(temporary_path, path)
+
+    logging.debug(f'Layer {area.level} is saved to {path}')
+
+
+def find_latest_layer(directory, fingerprint, max_level):
+    """
+    Returns the path to the deepest stored layer not deeper than
+    `max_level` produced with the same `fingerprint`, or None.
+    """
+    if not os.path.isdir(directory):
+        return None
+
+    prefix = fingerprint[:FINGERPRINT_PREFIX_LENGTH]
+    levels = sorted((int(match.group(2)) for match in
+                     map(lambda x: re.fullmatch(LAYER_FILE_REGEX, x),
+                         os.listdir(directory))
+                     if match and match.group(1) == prefix),
+                    reverse=True)
+
+    for level in filter(lambda x: x <= max_level, levels):
+
+        path = get_layer_path(directory, fingerprint, level)
+        # The full fingerprint is stored in the file, in case of prefix
+        # collisions
+        with np.load(path) as layer:
+            if str(layer['fingerprint']) == fingerprint:
+                return path
+
+    return None
+
+
+def load_layer(path):
+    """
+    Reads a stored layer into a dict of arrays suitable for
+    `ZoomableArea.set_state`.
+    """
+    with np.load(path) as layer:
+        return {key: layer[key] for key in layer.files
+                if key not in ('fingerprint', 'scc_sizes')}
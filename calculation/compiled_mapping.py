@@ -0,0 +1,164 @@
+import hashlib
+import importlib.util
+import logging
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+from calculation.model.symbolic_function import COMPILED_CACHE_PATH, \
+    SymbolicFunction, evict_least_recently_used, get_namespace, mark_used
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+KERNELS_DIRECTORY = 'kernels'
+# Generated modules kept on disk; the least recently used ones are removed
+# along with their machine code beyond that
+MAX_CACHED_KERNELS = 64
+# Loading numba and the cached machine code of a kernel alone takes about
+# a second, in which plain Python iterates several hundred thousand points,
+# so shorter orbits are not worth it
+ORBIT_COMPILATION_THRESHOLD = 500_000
+
+ORBIT_KERNEL_SOURCE = '''def advance_orbit(x_value, y_value, points):
+
+    for i in range(points.shape[0]):
+        x, y = x_value, y_value
+        x_value, y_value = float({x_source}), float({y_source})
+        points[i, 0], points[i, 1] = x_value, y_value
+
+    return x_value, y_value
+'''
+# Kernels live in generated modules, so that numba can cache their machine
+# code next to the module file and skip compilation on the following runs
+ORBIT_KERNEL_TEMPLATE = f'''import math
+
+from numba import njit
+
+
+@njit(cache=True, error_model='numpy')
+{ORBIT_KERNEL_SOURCE}'''
+# Plain Python counterpart over numpy scalars, which (like the jitted
+# kernel) turn domain errors and overflows into nan and inf rather than
+# raising the way the math module does
+PYTHON_ORBIT_KERNEL_SOURCE = '''def advance_orbit(x_value, y_value, points):
+
+    x_value, y_value = numpy.float64(x_value), numpy.float64(y_value)
+    with numpy.errstate(all='ignore'):
+        for i in range(points.shape[0]):
+            x, y = x_value, y_value
+            x_value = numpy.float64({x_source})
+            y_value = numpy.float64({y_source})
+            points[i, 0], points[i, 1] = x_value, y_value
+
+    return float(x_value), float(y_value)
+'''
+
+
+def supports_compilation(x_mapping, y_mapping):
+    return isinstance(x_mapping, SymbolicFunction) \
+        and isinstance(y_mapping, SymbolicFunction)
+
+
+def _evict_generated_modules(directory):
+    """
+    Removes the least recently loaded modules beyond `MAX_CACHED_KERNELS`,
+    along with the machine code numba cached for them.
+    """
+    numba_cache = os.path.join(directory, '__pycache__')
+    numba_files = os.listdir(numba_cache) if os.path.isdir(numba_cache) \
+        else []
+
+    def get_machine_code_paths(path):
+
+        name = os.path.basename(path)[:-len('.py')]
+        return [os.path.join(numba_cache, x) for x in numba_files
+                if x.startswith(f'{name}.')]
+
+    evict_least_recently_used(
+        [os.path.join(directory, x) for x in os.listdir(directory)
+         if x.endswith('.py')], MAX_CACHED_KERNELS, get_machine_code_paths)
+
+
+def _load_generated_module(name, source, cache_path):
+
+    path = os.path.join(cache_path, KERNELS_DIRECTORY, f'{name}.py')
+
+    # Rewriting an existing module would invalidate numba's cache
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            f.write(source)
+        os.replace(f'{path}.tmp', path)
+        _evict_generated_modules(os.path.dirname(path))
+
+    else:
+        mark_used(path)
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Numba resolves cached functions' globals by the module name
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+@lru_cache(maxsize=None)
+def compile_orbit_kernel(x_source, y_source, cache_path=COMPILED_CACHE_PATH):
+    """
+    Fuse both coordinate expressions, given as math-module Python source,
+    into one nopython `advance_orbit` function.
+    """
+    source = ORBIT_KERNEL_TEMPLATE.format(x_source=x_source,
+                                          y_source=y_source)
+    name = 'orbit_' + hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]
+
+    return _load_generated_module(name, source, cache_path).advance_orbit
+
+
+def build_python_orbit_kernel(x_mapping, y_mapping):
+    """
+    The same fused `advance_orbit` function as plain Python, evaluating the
+    NumPy sources of the mappings on numpy scalars.
+    """
+    namespace = get_namespace(sorted(set(x_mapping.sources['imports'])
+                                     | set(y_mapping.sources['imports'])))
+    exec(PYTHON_ORBIT_KERNEL_SOURCE.format(
+        x_source=x_mapping.sources['numpy'],
+        y_source=y_mapping.sources['numpy']), namespace)
+
+    return namespace['advance_orbit']
+
+
+def get_orbit_kernel(x_mapping, y_mapping, dtype, length=None):
+    """
+    Returns a jitted `advance_orbit(x, y, points) -> (x, y)` which writes
+    the next len(points) orbit points into the (n, 2) buffer, or None if
+    the mappings cannot be compiled and the caller has to fall back to the
+    interpreted loop. Orbits shorter than `ORBIT_COMPILATION_THRESHOLD`
+    points get the plain Python version of the kernel instead.
+    """
+    if not supports_compilation(x_mapping, y_mapping):
+        return None
+
+    if length is not None and length < ORBIT_COMPILATION_THRESHOLD:
+        return build_python_orbit_kernel(x_mapping, y_mapping)
+
+    # numba is only imported once there is something to compile
+    from numba.core.errors import NumbaError
+
+    try:
+        kernel = compile_orbit_kernel(x_mapping.sources['math'],
+                                      y_mapping.sources['math'])
+        # Forcing compilation (or cache loading) for the given buffer type
+        kernel(.0, .0, np.empty((0, 2), dtype=dtype))
+
+    except NumbaError as e:
+        logging.warning(f'Unable to compile the mapping, falling back to '
+                        f'interpreted mode: {e}')
+        return None
+
+    return kernel
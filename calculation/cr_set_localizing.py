@@ -1,20 +1,41 @@
+import importlib
 import logging
+from contextlib import nullcontext
 
 import numpy as np
 from tqdm import trange
 
-from calculation.model.component_graph import ComponentGraph
-from calculation.model.zoomable_area import ZoomableArea
-from monitoring.decorators import capture_execution_time, dump_profile
+from calculation.checkpointing import compute_fingerprint, \
+    find_latest_layer, get_layer_path, load_layer, save_layer
+from calculation.compiled_mapping import supports_compilation
+from calculation.invariant_measure import estimate_invariant_measure
+from calculation.model.localization_result import UNRANKED, \
+    LocalizationResult
+from calculation.model.symbolic_function import SymbolicFunction, \
+    get_jacobian
+from calculation.model.zoomable_area import IMAGE_MODES, \
+    SYMBOLIC_IMAGE_SAMPLES, ZoomableArea, create_symbolic_image_pool
+from calculation.sampling import SAMPLING_LAYOUTS
+from monitoring.decorators import capture_execution_time, dump_profile, \
+    record_metrics, record_span
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 INITIAL_FRAGMENTATION = (40, 40)
+SUPPORTED_DTYPES = (np.float32, np.float64)
+# Backends are imported on first use, so that a run doesn't pay for loading
+# the libraries (networkx or numba) of the backend it doesn't use
+GRAPH_BACKENDS = {
+    'networkx': 'calculation.model.component_graph.ComponentGraph',
+    'sparse': 'calculation.model.sparse_component_graph.SparseComponentGraph',
+}
 
 
 def _validate_args(x_mapping, y_mapping, area_bounds, cell_density, depth,
-                   topsort_enabled):
+                   topsort_enabled, dtype, graph_backend, workers,
+                   image_density, sampling_layout, image_mode, incremental,
+                   checkpoint_dir, resume, keep_layers, invariant_measure):
 
     if not callable(x_mapping):
         logging.error(f'`x_mapping` ({x_mapping}) is not a callable object; '
@@ -48,58 +69,313 @@ def _validate_args(x_mapping, y_mapping, area_bounds, cell_density, depth,
                       'pass boolean value instead')
         raise ValueError
 
+    if dtype not in SUPPORTED_DTYPES:
+        logging.error(f'Unsupported `dtype` given: {dtype}; '
+                      'pass either numpy.float32 or numpy.float64')
+        raise ValueError
+
+    if graph_backend not in GRAPH_BACKENDS:
+        logging.error(f'Unknown `graph_backend` given: {graph_backend}; '
+                      f'pass one of {", ".join(GRAPH_BACKENDS)}')
+        raise ValueError
+
+    if workers < 1:
+        logging.error(f'Invalid `workers` number given: {workers}; '
+                      'pass positive integer instead')
+        raise ValueError
+
+    if image_density < 1:
+        logging.error(f'Invalid `image_density` number given: {image_density}; '
+                      'pass positive integer instead')
+        raise ValueError
+
+    if sampling_layout not in SAMPLING_LAYOUTS:
+        logging.error(f'Unknown `sampling_layout` given: {sampling_layout}; '
+                      f'pass one of {", ".join(SAMPLING_LAYOUTS)}')
+        raise ValueError
+
+    if image_mode not in IMAGE_MODES:
+        logging.error(f'Unknown `image_mode` given: {image_mode}; '
+                      f'pass one of {", ".join(IMAGE_MODES)}')
+        raise ValueError
+
+    if image_mode == 'adaptive':
+
+        if not supports_compilation(x_mapping, y_mapping):
+            logging.error('Adaptive image mode differentiates mapping '
+                          'expressions; pass parsed mappings to use it')
+            raise ValueError
+
+        try:
+            get_jacobian(x_mapping, y_mapping)
+        except NotImplementedError as e:
+            logging.error('Mappings cannot be differentiated in adaptive '
+                          f'image mode: {e}')
+            raise ValueError
+
+    if image_mode == 'interval':
+
+        from calculation.interval_arithmetic import check_interval_support
+
+        for mapping in (x_mapping, y_mapping):
+
+            if not isinstance(mapping, SymbolicFunction):
+                logging.error(f'`{mapping}` has no symbolic expression; '
+                              'interval image mode requires parsed mappings')
+                raise ValueError
+
+            try:
+                check_interval_support(mapping.expression)
+            except NotImplementedError as e:
+                logging.error(f'`{mapping}` cannot be used in interval image '
+                              f'mode: {e}')
+                raise ValueError
+
+    if not isinstance(incremental, bool):
+        logging.error(f'Invalid `incremental` given: {incremental}; '
+                      'pass boolean value instead')
+        raise ValueError
+
+    if incremental and image_mode != 'interval':
+        logging.error('Incremental refinement narrows the images down to '
+                      'the ones of the previous layer, which only enclose '
+                      'every edge in `interval` image mode')
+        raise ValueError
+
+    if checkpoint_dir is not None \
+            and not supports_compilation(x_mapping, y_mapping):
+        logging.error('Checkpoints are identified by mapping expressions; '
+                      'pass parsed mappings to use `checkpoint_dir`')
+        raise ValueError
+
+    if resume and checkpoint_dir is None:
+        logging.error('`resume` requires `checkpoint_dir` to be set')
+        raise ValueError
+
+    if not isinstance(keep_layers, bool):
+        logging.error(f'Invalid `keep_layers` given: {keep_layers}; '
+                      'pass boolean value instead')
+        raise ValueError
+
+    if not isinstance(invariant_measure, bool):
+        logging.error(f'Invalid `invariant_measure` given: '
+                      f'{invariant_measure}; pass boolean value instead')
+        raise ValueError
+
+    if invariant_measure and image_mode == 'interval':
+        logging.error('Invariant measure is estimated from the transitions '
+                      'of sample points; use `sampling` or `adaptive` image '
+                      'mode')
+        raise ValueError
+
+
+def _load_layer_snapshots(checkpoint_dir, fingerprint, level):
+    """
+    Snapshots of the stored layers preceding `level`, or an empty list if
+    any of them is missing.
+    """
+    snapshots = []
+
+    for i in range(level):
+
+        path = find_latest_layer(checkpoint_dir, fingerprint, i)
+        if path != get_layer_path(checkpoint_dir, fingerprint, i):
+            logging.warning(f'Layer {i} is not stored, only the layers from '
+                            f'{level} on are kept')
+            return []
+
+        snapshots.append(ZoomableArea.get_state_snapshot(load_layer(path)))
+
+    return snapshots
+
+
+def _get_graph_class(graph_backend):
+
+    module_name, _, class_name = GRAPH_BACKENDS[graph_backend].rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _get_fingerprint(x_mapping, y_mapping, area, seed):
+    return compute_fingerprint(x_mapping=x_mapping, y_mapping=y_mapping,
+                               seed=seed, **area.parameters)
+
 
 @dump_profile
 @capture_execution_time
+@record_metrics
 def condense_connected_components(x_mapping, y_mapping,
                                   area_bounds=(0, 0, 1, 1), cell_density=100,
-                                  depth=5, topsort_enabled=False):
+                                  depth=5, topsort_enabled=False,
+                                  dtype=np.float32, graph_backend='networkx',
+                                  workers=1,
+                                  image_density=SYMBOLIC_IMAGE_SAMPLES,
+                                  sampling_layout='random', seed=None,
+                                  image_mode='sampling', incremental=False,
+                                  checkpoint_dir=None, resume=False,
+                                  cache=None, keep_layers=False,
+                                  invariant_measure=False):
+    """
+    Returns a LocalizationResult with the cells of the last layer, their
+    clusters and, with `topsort_enabled`, the topological rank of every
+    cluster; points are sampled `cell_density` per cell on request. With
+    `keep_layers`, snapshots of all the layers are kept in it as well.
+
+    With `incremental` (interval image mode only), a cell is only connected
+    to the children of its parent's targets at the previous layer. The
+    enclosure of the parent's image is as rigorous as the cell's own one,
+    so this drops no edge of the mapping, only the parts of the cell's
+    enclosure sticking out of its parent's one. Candidate cells are also
+    enumerated among these children whenever they are fewer than the grid
+    positions of the enclosure.
+
+    With `invariant_measure`, the symbolic image of the last layer keeps the
+    number of samples behind every edge, and the invariant measure of every
+    cluster is estimated from these transition probabilities (Ulam method).
+    The measure of every cell is returned in the result, summing up to one
+    within every cluster.
+
+    With `checkpoint_dir` set, every completed layer is stored there; with
+    `resume` the run continues from the deepest stored layer computed with
+    the same settings (shallower runs of the same settings included).
 
+    Given a `ResultCache`, the layers of parsed mappings are stored in and
+    resumed from the cache entry of the run settings instead.
+
+    Wall and CPU time, memory peaks and item counts of every stage of every
+    layer are reported through `monitoring.decorators.record_metrics`.
+    """
     try:
         _validate_args(x_mapping, y_mapping, area_bounds, cell_density, depth,
-                      topsort_enabled)
+                      topsort_enabled, dtype, graph_backend, workers,
+                      image_density, sampling_layout, image_mode, incremental,
+                      checkpoint_dir, resume, keep_layers, invariant_measure)
     except ValueError:
         logging.error('Aborting connected components localization...')
         return None
 
-    cg_init = ComponentGraph()
-    area = ZoomableArea(area_bounds, *INITIAL_FRAGMENTATION, tuple())
+    graph_class = _get_graph_class(graph_backend)
+    area = ZoomableArea(area_bounds, *INITIAL_FRAGMENTATION,
+                        image_density, sampling_layout, seed, image_mode,
+                        incremental)
+
+    # The cache entry is only created for valid arguments
+    if cache is not None and checkpoint_dir is None \
+            and supports_compilation(x_mapping, y_mapping):
+        checkpoint_dir = cache.get_entry(
+            'localization',
+            fingerprint=_get_fingerprint(x_mapping, y_mapping, area, seed))
+        resume = True
+
+    fingerprint = _get_fingerprint(x_mapping, y_mapping, area, seed) \
+        if checkpoint_dir is not None else None
+
+    # The last layer graph (and its transitions) is needed for sorting and
+    # measure estimation, so it is never restored then
+    stored_layer = find_latest_layer(
+        checkpoint_dir, fingerprint,
+        depth - int(topsort_enabled or invariant_measure)) \
+        if resume else None
+
+    layers = []
+
+    # Workers are started once for all the layers
+    with create_symbolic_image_pool(workers, x_mapping, y_mapping) \
+            if workers > 1 else nullcontext() as pool:
+
+        if stored_layer is not None:
+            logging.info(f'Resuming from {stored_layer}...')
+            area.set_state(load_layer(stored_layer))
+
+            if keep_layers:
+                layers = _load_layer_snapshots(checkpoint_dir, fingerprint,
+                                               area.level)
+
+        else:
+            cg_init = graph_class()
 
-    area.do_initial_fragmentation(cg_init)
-    area.fill_symbolic_image(cg_init, x_mapping, y_mapping)
-    area.markup_entire_area(cg_init)
+            area.do_initial_fragmentation(cg_init)
+            area.fill_symbolic_image(cg_init, x_mapping, y_mapping, workers,
+                                     pool)
+            area.markup_entire_area(cg_init)
 
-    components_order = []
+            if checkpoint_dir is not None:
+                with record_span('checkpoint', level=area.level):
+                    save_layer(checkpoint_dir, fingerprint, area, cg_init)
 
-    for i in trange(depth):
+        if keep_layers:
+            layers.append(area.get_snapshot())
 
-        cg = ComponentGraph()
+        components_order = []
+        cluster_ranks = None
 
-        area.do_regular_fragmentation(cg)
-        area.fill_symbolic_image(cg, x_mapping, y_mapping)
-        area.markup_entire_area(cg)
+        for i in trange(area.level, depth):
 
-        if topsort_enabled and i == depth - 1:
+            cg = graph_class()
 
-            logging.info('Launching topological sorting on the last layer...')
-            condensed_cg = cg.generate_condensed_graph()
-            sorted_reversed = condensed_cg.sort_nodes()
-            dense_components = cg.dense_components
+            area.do_regular_fragmentation(cg)
+            area.count_transitions = invariant_measure and i == depth - 1
+            area.fill_symbolic_image(cg, x_mapping, y_mapping, workers,
+                                     pool)
+            area.markup_entire_area(cg)
 
-            for node in sorted_reversed:
-                if condensed_cg.nodes[node]['group'] < len(dense_components):
-                    components_order.insert(0, node)
+            if checkpoint_dir is not None:
+                with record_span('checkpoint', level=area.level):
+                    save_layer(checkpoint_dir, fingerprint, area, cg)
 
+            if keep_layers:
+                layers.append(area.get_snapshot())
+
+            if topsort_enabled and i == depth - 1:
+
+                logging.info('Launching topological sorting on the last '
+                             'layer...')
+                with record_span('topsort', level=area.level) as span:
+                    condensed_cg = cg.generate_condensed_graph()
+                    sorted_reversed = condensed_cg.sort_nodes()
+                    dense_components_number = cg.dense_components_number
+
+                    for node in reversed(sorted_reversed):
+                        if condensed_cg.get_node_group(node) \
+                                < dense_components_number:
+                            components_order.append(node)
+
+                    cluster_ranks = np.full(dense_components_number, UNRANKED,
+                                            dtype=np.int64)
+                    cluster_ranks[[condensed_cg.get_node_group(x)
+                                   for x in components_order]] = \
+                        np.arange(len(components_order))
+                    span['components'] = len(sorted_reversed)
 
     if topsort_enabled:
-        print('Order of SCC:', *[x[0] for x in components_order], sep='\n')
+        print('Order of SCC:', *[condensed_cg.get_node_group(x)
+                                 for x in components_order], sep='\n')
+
+    if cache is not None:
+        cache.evict(keep=checkpoint_dir)
+
+    with record_span('extraction', level=area.level) as span:
+        active = area.get_active_cells()
+        clusters = area.clusters[active].astype(np.int64)
+        ranks = cluster_ranks[clusters] if cluster_ranks is not None \
+            else np.full(active.size, UNRANKED, dtype=np.int64)
+        bounds = area.get_cell_bounds(active)
+        span['cells'] = int(active.size)
+
+    measure = None
+    if invariant_measure:
+
+        logging.info('Estimating invariant measure of the clusters...')
+        with record_span('invariant_measure', level=area.level) as span:
+            cell_clusters = np.full(area.cells_number, -1, dtype=np.int64)
+            cell_clusters[active] = clusters
+            cell_measure, span['iterations'] = estimate_invariant_measure(
+                *area.transitions, cell_clusters)
+            measure = cell_measure[active]
+            span['edges'] = int(area.transitions[0].size)
 
-    points = []
-    area.get_active_area_points(cell_density, points)
-    xs = np.empty(len(points), dtype=np.float32)
-    ys = np.empty(len(points), dtype=np.float32)
-    for i, elem in enumerate(points):
-        xs[i] = elem[0]
-        ys[i] = elem[1]
+    geometry = {key: area.parameters[key]
+                for key in ('area_bounds', 'cells_by_x', 'cells_by_y')}
 
-    return xs, ys
+    return LocalizationResult(bounds, clusters, ranks, cell_density,
+                              area.random_generator, sampling_layout, dtype,
+                              geometry, layers, measure)
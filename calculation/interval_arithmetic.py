@@ -0,0 +1,176 @@
+import numpy as np
+from sympy import Abs, Add, Mul, Number, Pow, Symbol, cos, exp, log, pi, sin
+from sympy.abc import x, y
+
+
+def _widen(lower, upper):
+    """
+    Rounds the bounds outwards by one ulp to make up for the rounding
+    errors of floating-point operations.
+    """
+    return np.nextafter(lower, -np.inf), np.nextafter(upper, np.inf)
+
+
+def _add(first, second):
+    return _widen(first[0] + second[0], first[1] + second[1])
+
+
+def _multiply(first, second):
+
+    with np.errstate(invalid='ignore'):
+        products = np.stack((first[0] * second[0], first[0] * second[1],
+                             first[1] * second[0], first[1] * second[1]))
+
+    # 0 * inf gives nan, which is only possible for zero bounds
+    products = np.nan_to_num(products, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    return _widen(products.min(axis=0), products.max(axis=0))
+
+
+def _reciprocal(interval):
+
+    lower, upper = interval
+    contains_zero = (lower <= 0) & (upper >= 0)
+
+    # Bounds next to zero overflow to infinity, as they should
+    with np.errstate(divide='ignore', over='ignore'):
+        new_lower = np.where(contains_zero, -np.inf, 1 / upper)
+        new_upper = np.where(contains_zero, np.inf, 1 / lower)
+
+    return _widen(new_lower, new_upper)
+
+
+def _integer_power(interval, exponent):
+
+    if exponent < 0:
+        return _reciprocal(_integer_power(interval, -exponent))
+
+    lower, upper = interval
+
+    with np.errstate(over='ignore'):
+        lower_power, upper_power = lower**exponent, upper**exponent
+
+    if exponent % 2:
+        return _widen(lower_power, upper_power)
+
+    contains_zero = (lower <= 0) & (upper >= 0)
+    new_lower = np.where(contains_zero, 0.0,
+                         np.minimum(lower_power, upper_power))
+
+    return _widen(new_lower, np.maximum(lower_power, upper_power))
+
+
+def _cos(interval):
+
+    lower, upper = interval
+    period = 2 * np.pi
+
+    # An interval reaches the maximum if it contains 2k * pi and the minimum
+    # if it contains (2k + 1) * pi
+    has_maximum = np.floor(upper / period) >= np.ceil(lower / period)
+    has_minimum = np.floor((upper - np.pi) / period) \
+        >= np.ceil((lower - np.pi) / period)
+
+    lower_cos, upper_cos = np.cos(lower), np.cos(upper)
+    new_lower = np.where(has_minimum, -1.0, np.minimum(lower_cos, upper_cos))
+    new_upper = np.where(has_maximum, 1.0, np.maximum(lower_cos, upper_cos))
+
+    new_lower, new_upper = _widen(new_lower, new_upper)
+    return np.maximum(new_lower, -1.0), np.minimum(new_upper, 1.0)
+
+
+def _sin(interval):
+    return _cos(_add(interval, (-np.pi / 2, -np.pi / 2)))
+
+
+def _exp(interval):
+
+    with np.errstate(over='ignore'):
+        return _widen(np.exp(interval[0]), np.exp(interval[1]))
+
+
+def _log(interval):
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(interval[0] > 0, np.log(interval[0]), -np.inf)
+        upper = np.where(interval[1] > 0, np.log(interval[1]), np.inf)
+
+    return _widen(lower, upper)
+
+
+def _abs(interval):
+
+    lower, upper = interval
+    contains_zero = (lower <= 0) & (upper >= 0)
+
+    return np.where(contains_zero, 0.0,
+                    np.minimum(np.abs(lower), np.abs(upper))), \
+        np.maximum(np.abs(lower), np.abs(upper))
+
+
+_FUNCTIONS = {
+    cos: _cos,
+    sin: _sin,
+    exp: _exp,
+    log: _log,
+    Abs: _abs,
+}
+
+
+def _evaluate(expression, variables):
+
+    if isinstance(expression, Symbol):
+        return variables[expression]
+
+    if isinstance(expression, Number) or expression == pi:
+        value = float(expression)
+        return _widen(value, value)
+
+    if isinstance(expression, Add):
+        result = _evaluate(expression.args[0], variables)
+        for argument in expression.args[1:]:
+            result = _add(result, _evaluate(argument, variables))
+        return result
+
+    if isinstance(expression, Mul):
+        result = _evaluate(expression.args[0], variables)
+        for argument in expression.args[1:]:
+            result = _multiply(result, _evaluate(argument, variables))
+        return result
+
+    if isinstance(expression, Pow):
+        base, exponent = expression.args
+        if exponent.is_Integer:
+            return _integer_power(_evaluate(base, variables), int(exponent))
+        # Non-integer powers are monotonic for the non-negative base
+        return _exp(_multiply(_log(_evaluate(base, variables)),
+                              _evaluate(exponent, variables)))
+
+    if expression.func in _FUNCTIONS and len(expression.args) == 1:
+        return _FUNCTIONS[expression.func](
+            _evaluate(expression.args[0], variables))
+
+    raise NotImplementedError(
+        f'Interval evaluation is not supported for {expression.func}')
+
+
+def check_interval_support(expression):
+    """
+    Raises NotImplementedError if `expression` contains operations which
+    cannot be evaluated over intervals.
+    """
+    _evaluate(expression, {x: (.0, .0), y: (.0, .0)})
+
+
+def evaluate_interval(expression, x_interval, y_interval):
+    """
+    Encloses the range of `expression` over boxes x_interval x y_interval,
+    each given as a (lower, upper) pair of arrays. Returns the (lower, upper)
+    pair of arrays; an unbounded or undefined range gives infinite bounds.
+    """
+    lower, upper = _evaluate(expression, {x: x_interval, y: y_interval})
+    shape = np.broadcast(x_interval[0], y_interval[0]).shape
+
+    lower = np.where(np.isnan(lower), -np.inf, lower)
+    upper = np.where(np.isnan(upper), np.inf, upper)
+
+    return np.broadcast_to(lower, shape), np.broadcast_to(upper, shape)
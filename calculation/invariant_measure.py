@@ -0,0 +1,65 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MEASURE_TOLERANCE = 1e-10
+MEASURE_MAX_ITERATIONS = 100_000
+# Share of the measure kept in place at every step. The invariant measure
+# of such a lazy chain is the same, but the iteration converges on periodic
+# components as well
+MEASURE_LAZINESS = .1
+
+
+def get_transition_matrix(sources, targets, counts, clusters):
+    """
+    Ulam approximation of the transfer operator: the transitions between
+    cells of the same cluster, weighted by the share of the source samples
+    mapped into the target. Returns the matrix as (sources, targets,
+    probabilities) arrays; every row of a cluster sums up to one.
+    """
+    inner = (clusters[sources] >= 0) & (clusters[sources] == clusters[targets])
+    sources, targets = sources[inner], targets[inner]
+    weights = counts[inner].astype(np.float64)
+
+    totals = np.bincount(sources, weights=weights, minlength=clusters.size)
+    return sources, targets, weights / totals[sources]
+
+
+def estimate_invariant_measure(sources, targets, counts, clusters,
+                               tolerance=MEASURE_TOLERANCE,
+                               max_iterations=MEASURE_MAX_ITERATIONS):
+    """
+    Invariant measure of every cluster (a strongly connected component,
+    negative labels stand for cells out of any) of the symbolic image with
+    transitions counted in `counts`, found by power iteration of the sparse
+    stochastic matrix. Returns the measure of every cell, summing up to one
+    within every cluster, along with the number of iterations made.
+    """
+    sources, targets, probabilities = get_transition_matrix(
+        sources, targets, counts, clusters)
+
+    in_cluster = clusters >= 0
+    sizes = np.bincount(clusters[in_cluster])
+    measure = np.zeros(clusters.size)
+    measure[in_cluster] = 1 / sizes[clusters[in_cluster]]
+
+    for iteration in range(1, max_iterations + 1):
+
+        updated = MEASURE_LAZINESS * measure + (1 - MEASURE_LAZINESS) \
+            * np.bincount(targets, weights=measure[sources] * probabilities,
+                          minlength=clusters.size)
+        change = np.abs(updated - measure).sum()
+        measure = updated
+
+        if change < tolerance:
+            break
+
+    else:
+        logging.warning(f'Invariant measure has not converged after '
+                        f'{max_iterations} iterations, the last change is '
+                        f'{change}')
+
+    return measure, iteration
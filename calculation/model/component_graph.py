@@ -1,7 +1,7 @@
 import logging
-from collections import deque
 
 import networkx as nx
+import numpy as np
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -12,30 +12,46 @@ class ComponentGraph(nx.DiGraph):
     def __init__(self, *args):
 
         super().__init__(*args)
-        self._grey_nodes = deque()
-        self._blacklisted = []
         self._strongly_connected_components = []
 
     @staticmethod
     def _gen_simple_node_id(i):
-        return (i, )
+        return i
 
-    def _perform_dfs(self, start_node):
+    def _perform_dfs(self, start_node, visited, order):
 
-        self._grey_nodes.append(start_node)
-        for neighbour in self.adj[start_node]:
-            if neighbour not in self._blacklisted:
-                self._perform_dfs(neighbour)
+        # Explicit stack of (node, its unvisited neighbours) pairs instead of
+        # recursion, so that deep graphs don't hit the recursion limit
+        visited.add(start_node)
+        grey_nodes = [(start_node, iter(self.adj[start_node]))]
 
-        self._blacklisted.append(self._grey_nodes.pop())
+        while grey_nodes:
 
-    def sort_nodes(self):
+            node, neighbours = grey_nodes[-1]
 
-        for node in [edge[0] for edge in self.edges]:
-            if node not in self._blacklisted:
-                self._perform_dfs(node)
+            for neighbour in neighbours:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    grey_nodes.append((neighbour, iter(self.adj[neighbour])))
+                    break
+            else:
+                grey_nodes.pop()
+                order.append(node)
 
-        return self._blacklisted
+    def sort_nodes(self, as_array=False):
+        """
+        Returns all the nodes in DFS post-order, which is the reversed
+        topological order for an acyclic graph. Node ids must be integers
+        for `as_array`.
+        """
+        visited = set()
+        order = []
+
+        for node in self.nodes:
+            if node not in visited:
+                self._perform_dfs(node, visited, order)
+
+        return np.array(order, dtype=np.int64) if as_array else order
 
     def initialize_strongly_connected_components(self):
 
@@ -48,6 +64,27 @@ class ComponentGraph(nx.DiGraph):
     @property
     def scc_components(self):
         return self._strongly_connected_components
+
+    @property
+    def scc_labels(self):
+        """
+        Component index for every node; requires nodes to be integers
+        0..n-1, as in the graphs built by ZoomableArea.
+        """
+        labels = np.empty(len(self), dtype=np.int64)
+        for i, component in enumerate(self._strongly_connected_components):
+            labels[list(component)] = i
+
+        return labels
+
+    @property
+    def scc_sizes(self):
+        return np.array([len(x) for x in self._strongly_connected_components],
+                        dtype=np.int64)
+
+    @property
+    def dense_components_number(self):
+        return len(self.dense_components)
     
     @property
     def dense_components(self):
@@ -97,6 +134,20 @@ class ComponentGraph(nx.DiGraph):
         self.add_node(id_)
         self.nodes[id_]['group'] = group
 
+    def add_complex_nodes(self, ids_, group=-1):
+        self.add_nodes_from(ids_, group=group)
+
+    def add_edge_arrays(self, sources, targets):
+        self.add_edges_from(zip(sources.tolist(), targets.tolist()))
+
+    def get_edge_arrays(self):
+
+        edges = np.array(self.edges, dtype=np.int64).reshape(-1, 2)
+        return edges[:, 0], edges[:, 1]
+
+    def get_node_group(self, id_):
+        return self.nodes[id_]['group']
+
     def add_edge_for_complex_nodes(self, id_1, id_2):
 
         self.add_complex_node(id_1)
@@ -0,0 +1,115 @@
+import numpy as np
+
+from calculation.model.zoomable_area import get_codes_bounds
+from calculation.sampling import sample_cells
+from monitoring.decorators import record_metrics, record_span
+
+UNRANKED = -1
+
+
+class LocalizationResult:
+    """
+    Active cells of the last localization layer: `bounds` is an (n, 4)
+    array of (sw_x, sw_y, ne_x, ne_y) rows, `clusters` holds the strongly
+    connected component of every cell (components are numbered by size,
+    largest first) and `ranks` the position of that component in the
+    topological order, or UNRANKED if sorting was not enabled.
+
+    Points sampled within the cells are only generated when requested.
+    Snapshots of the intermediate `layers`, if kept, hold the active cell
+    codes only; `geometry` (area bounds and initial fragmentation) turns
+    them into rectangles on request.
+
+    If estimated, `measure` holds the invariant measure of every cell; it
+    sums up to one within every cluster.
+    """
+
+    def __init__(self, bounds, clusters, ranks, cell_density,
+                 random_generator, sampling_layout='random',
+                 dtype=np.float32, geometry=None, layers=None,
+                 measure=None):
+
+        self.bounds = bounds
+        self.clusters = clusters
+        self.ranks = ranks
+        self.cell_density = cell_density
+        self.dtype = dtype
+        self.geometry = geometry
+        self.layers = layers or []
+        self.measure = measure
+
+        self._random_generator = random_generator
+        self._sampling_layout = sampling_layout
+        self._points = None
+
+    def __len__(self):
+        return self.bounds.shape[0]
+
+    @property
+    def clusters_number(self):
+        return np.unique(self.clusters).size
+
+    @property
+    def points(self):
+        """
+        (n * cell_density, 2) array of points sampled in the cells, grouped
+        by cell in the order of `bounds`. Sampled once and kept afterwards.
+        """
+        if self._points is None:
+            self._points = self._sample_points()
+
+        return self._points
+
+    @record_metrics
+    def _sample_points(self):
+
+        # Points are sampled after the localization run has been reported,
+        # so their extraction is reported as a measured call of its own
+        with record_span('point_extraction', cells=len(self)) as span:
+            xs, ys = sample_cells(self.bounds, self.cell_density,
+                                  self._random_generator,
+                                  self._sampling_layout)
+            points = np.column_stack(
+                (xs.ravel(), ys.ravel())).astype(self.dtype, copy=False)
+            span['points'] = points.shape[0]
+
+        return points
+
+    @property
+    def point_clusters(self):
+        """
+        Cluster of every point of `points`.
+        """
+        return np.repeat(self.clusters, self.cell_density)
+
+    def get_layer_cells(self, index):
+        """
+        Returns (n, 4) bounds and clusters of the active cells of the layer
+        snapshot `index`.
+        """
+        layer = self.layers[index]
+        return get_codes_bounds(layer['codes'], layer['level'],
+                                **self.geometry), layer['clusters']
+
+    @property
+    def density(self):
+        """
+        Invariant measure of every cell divided by the cell area.
+        """
+        if self.measure is None:
+            return None
+
+        return self.measure / ((self.bounds[:, 2] - self.bounds[:, 0])
+                               * (self.bounds[:, 3] - self.bounds[:, 1]))
+
+    def to_arrays(self):
+
+        arrays = {
+            'bounds': self.bounds,
+            'clusters': self.clusters,
+            'ranks': self.ranks,
+        }
+        if self.measure is not None:
+            arrays['measure'] = self.measure
+
+        return arrays
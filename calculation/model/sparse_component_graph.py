@@ -0,0 +1,250 @@
+import logging
+
+import numpy as np
+from numba import njit
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+@njit(cache=True)
+def _find_strongly_connected_components(indptr, indices):
+    """
+    Iterative Tarjan's algorithm over a CSR adjacency. Returns the component
+    label of every node and the number of components; labels are assigned
+    in reverse topological order of the condensation.
+    """
+    nodes_number = indptr.size - 1
+    index = np.full(nodes_number, -1, dtype=np.int64)
+    lowlink = np.zeros(nodes_number, dtype=np.int64)
+    on_stack = np.zeros(nodes_number, dtype=np.bool_)
+    labels = np.full(nodes_number, -1, dtype=np.int64)
+
+    stack = np.empty(nodes_number, dtype=np.int64)
+    call_nodes = np.empty(nodes_number, dtype=np.int64)
+    call_edges = np.empty(nodes_number, dtype=np.int64)
+    stack_size = 0
+    counter = 0
+    components_number = 0
+
+    for root in range(nodes_number):
+
+        if index[root] != -1:
+            continue
+
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack[stack_size] = root
+        stack_size += 1
+        on_stack[root] = True
+        call_nodes[0], call_edges[0] = root, indptr[root]
+        depth = 1
+
+        while depth > 0:
+
+            node = call_nodes[depth - 1]
+            edge = call_edges[depth - 1]
+
+            if edge < indptr[node + 1]:
+
+                call_edges[depth - 1] = edge + 1
+                neighbour = indices[edge]
+
+                if index[neighbour] == -1:
+                    index[neighbour] = lowlink[neighbour] = counter
+                    counter += 1
+                    stack[stack_size] = neighbour
+                    stack_size += 1
+                    on_stack[neighbour] = True
+                    call_nodes[depth] = neighbour
+                    call_edges[depth] = indptr[neighbour]
+                    depth += 1
+
+                elif on_stack[neighbour]:
+                    lowlink[node] = min(lowlink[node], index[neighbour])
+
+                continue
+
+            if lowlink[node] == index[node]:
+                while True:
+                    stack_size -= 1
+                    member = stack[stack_size]
+                    on_stack[member] = False
+                    labels[member] = components_number
+                    if member == node:
+                        break
+
+                components_number += 1
+
+            depth -= 1
+            if depth > 0:
+                parent = call_nodes[depth - 1]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    return labels, components_number
+
+
+@njit(cache=True)
+def _sort_nodes_in_postorder(indptr, indices):
+
+    nodes_number = indptr.size - 1
+    visited = np.zeros(nodes_number, dtype=np.bool_)
+    order = np.empty(nodes_number, dtype=np.int64)
+    call_nodes = np.empty(nodes_number, dtype=np.int64)
+    call_edges = np.empty(nodes_number, dtype=np.int64)
+    ordered = 0
+
+    for root in range(nodes_number):
+
+        if visited[root]:
+            continue
+
+        visited[root] = True
+        call_nodes[0], call_edges[0] = root, indptr[root]
+        depth = 1
+
+        while depth > 0:
+
+            node = call_nodes[depth - 1]
+            edge = call_edges[depth - 1]
+
+            if edge < indptr[node + 1]:
+                call_edges[depth - 1] = edge + 1
+                neighbour = indices[edge]
+
+                if not visited[neighbour]:
+                    visited[neighbour] = True
+                    call_nodes[depth] = neighbour
+                    call_edges[depth] = indptr[neighbour]
+                    depth += 1
+
+                continue
+
+            order[ordered] = node
+            ordered += 1
+            depth -= 1
+
+    return order
+
+
+class SparseComponentGraph:
+    """
+    ComponentGraph counterpart for graphs whose nodes are integers 0..n-1.
+    Edges are stored as a CSR adjacency, and SCCs, condensation and node
+    ordering are computed by jitted kernels over it.
+    """
+
+    def __init__(self):
+
+        self.nodes_number = 0
+        self._pending_edges = []
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.empty(0, dtype=np.int32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._sizes = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.nodes_number
+
+    def add_complex_nodes(self, ids_, group=-1):
+        self.nodes_number = max(self.nodes_number, max(ids_, default=-1) + 1)
+
+    def add_edge_arrays(self, sources, targets):
+        self._pending_edges.append((np.asarray(sources, dtype=np.int64),
+                                    np.asarray(targets, dtype=np.int64)))
+
+    def _build_adjacency(self):
+        """
+        Merges the edges added since the last build into the CSR arrays,
+        dropping duplicates.
+        """
+        built_sources = np.repeat(
+            np.arange(self._indptr.size - 1, dtype=np.int64),
+            np.diff(self._indptr))
+        sources = np.concatenate(
+            [built_sources, *[x[0] for x in self._pending_edges]])
+        targets = np.concatenate(
+            [self._indices, *[x[1] for x in self._pending_edges]])
+        self._pending_edges = []
+
+        edges = np.unique(sources * self.nodes_number + targets)
+
+        self._indices = (edges % self.nodes_number).astype(np.int32)
+        self._indptr = np.zeros(self.nodes_number + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges // self.nodes_number,
+                              minlength=self.nodes_number),
+                  out=self._indptr[1:])
+
+    @property
+    def adjacency(self):
+        """
+        CSR adjacency as (indptr, indices) arrays.
+        """
+        if self._pending_edges \
+                or self._indptr.size != self.nodes_number + 1:
+            self._build_adjacency()
+
+        return self._indptr, self._indices
+
+    @property
+    def edges_number(self):
+        return self.adjacency[1].size
+
+    def get_edge_arrays(self):
+
+        indptr, indices = self.adjacency
+        return np.repeat(np.arange(self.nodes_number), np.diff(indptr)), \
+            indices.astype(np.int64)
+
+    def sort_nodes(self, as_array=False):
+
+        order = _sort_nodes_in_postorder(*self.adjacency)
+        return order if as_array else order.tolist()
+
+    def initialize_strongly_connected_components(self):
+
+        labels, components_number = \
+            _find_strongly_connected_components(*self.adjacency)
+        sizes = np.bincount(labels, minlength=components_number)
+
+        # Transit components are placed in the trailing part
+        order = np.argsort(-sizes, kind='stable')
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(order.size)
+
+        self._labels = ranks[labels]
+        self._sizes = sizes[order]
+
+    @property
+    def scc_labels(self):
+        return self._labels
+
+    @property
+    def scc_sizes(self):
+        return self._sizes
+
+    @property
+    def dense_components_number(self):
+        return int(np.count_nonzero(self._sizes > 1))
+
+    def get_node_group(self, id_):
+        return id_
+
+    def generate_condensed_graph(self):
+
+        self.initialize_strongly_connected_components()
+
+        indptr, indices = self.adjacency
+        sources = self._labels[np.repeat(
+            np.arange(self.nodes_number), np.diff(indptr))]
+        targets = self._labels[indices]
+
+        # We mustn't register auto-loops for correct `sort_nodes` work
+        distinct = sources != targets
+
+        # Node id in `condensed` corresponds to the index of the component
+        condensed = SparseComponentGraph()
+        condensed.add_complex_nodes(range(self._sizes.size))
+        condensed.add_edge_arrays(sources[distinct], targets[distinct])
+
+        return condensed
@@ -0,0 +1,240 @@
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import shutil
+
+import numpy as np
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+COMPILED_CACHE_PATH = '.compiled'
+EXPRESSIONS_DIRECTORY = 'expressions'
+# Expression sources kept on disk; the least recently used ones are removed
+# beyond that, so that parameter sweeps don't grow the cache without limit
+MAX_CACHED_EXPRESSIONS = 1024
+
+
+def _generate_sources(expression):
+
+    # Sympy is heavy to import, so it is only loaded on cache misses
+    from sympy import srepr
+    from sympy.printing.numpy import NumPyPrinter
+    from sympy.printing.pycode import pycode
+
+    printer = NumPyPrinter()
+    numpy_source = printer.doprint(expression)
+
+    return {
+        'canonical': srepr(expression),
+        'numpy': numpy_source,
+        # Modules the NumPy source refers to besides numpy itself, e.g.
+        # functools for Max and Min
+        'imports': sorted(printer.module_imports),
+        'math': pycode(expression),
+        'symbols': sorted(str(x) for x in expression.free_symbols),
+    }
+
+
+def get_namespace(imports):
+
+    namespace = {'numpy': np, 'math': math}
+    for module in imports:
+        # The source refers to submodules by their full dotted name
+        importlib.import_module(module)
+        package = module.partition('.')[0]
+        namespace[package] = importlib.import_module(package)
+
+    return namespace
+
+
+class SymbolicFunction:
+    """
+    Callable f(x, y) which keeps the expression it was built from, so that
+    compiled kernels can be generated for it later on. The sympy expression
+    itself is parsed on demand only; everything needed for evaluation and
+    compilation is kept as generated source.
+    """
+
+    def __init__(self, text, sources, expression=None):
+
+        self.text = text
+        self.sources = sources
+        self._expression = expression
+        self._callable = eval(f'lambda x, y: {sources["numpy"]}',
+                              get_namespace(sources['imports']))
+
+    @classmethod
+    def from_expression(cls, expression):
+        return cls(str(expression), _generate_sources(expression), expression)
+
+    @property
+    def expression(self):
+
+        if self._expression is None:
+            # The canonical form already has the parameters substituted
+            from sympy import sympify
+            self._expression = sympify(self.canonical)
+
+        return self._expression
+
+    @property
+    def canonical(self):
+        return self.sources['canonical']
+
+    @property
+    def symbols(self):
+        return self.sources['symbols']
+
+    def __call__(self, x_value, y_value):
+        return self._callable(x_value, y_value)
+
+    def __reduce__(self):
+        # Generated lambdas are not picklable, rebuilding from sources
+        return SymbolicFunction, (self.text, self.sources)
+
+    def __repr__(self):
+        return f'SymbolicFunction({self.text})'
+
+
+def mark_used(path):
+    # Modification time tracks the last use for eviction
+    os.utime(path)
+
+
+def evict_least_recently_used(paths, keep, get_related_paths=None):
+    """
+    Removes all but the `keep` most recently used of `paths` (see
+    `mark_used`), along with `get_related_paths(path)` of every one.
+    """
+    if len(paths) <= keep:
+        return
+
+    def get_last_use(path):
+
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            return 0
+
+    for path in sorted(paths, key=get_last_use, reverse=True)[keep:]:
+        related_paths = get_related_paths(path) if get_related_paths else []
+
+        for removed in [path, *related_paths]:
+            try:
+                os.remove(removed)
+            except FileNotFoundError:
+                # Evicted by a concurrent run already
+                pass
+
+
+def _get_cached_sources(key_data, build_expression, cache_path):
+    """
+    Sources of the expression identified by JSON-serializable `key_data`:
+    loaded from the cache, or generated from `build_expression()` and stored
+    there. Returns the sources along with the expression, if it was built.
+    """
+    key = hashlib.sha256(json.dumps(key_data).encode('utf-8')).hexdigest()
+    path = os.path.join(cache_path, EXPRESSIONS_DIRECTORY, f'{key}.json')
+
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            sources = json.load(f)
+
+        # Sources cached before the imports were stored are regenerated
+        if 'imports' in sources:
+            mark_used(path)
+            return sources, None
+
+    expression = build_expression()
+    sources = _generate_sources(expression)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(sources, f)
+    os.replace(f'{path}.tmp', path)
+
+    directory = os.path.dirname(path)
+    evict_least_recently_used(
+        [os.path.join(directory, x) for x in os.listdir(directory)
+         if x.endswith('.json')], MAX_CACHED_EXPRESSIONS)
+
+    return sources, expression
+
+
+def parse_symbolic_function(text, parameters=None,
+                            cache_path=COMPILED_CACHE_PATH):
+    """
+    Builds a SymbolicFunction from the textual expression, substituting
+    numeric values of `parameters` (e.g. {'a': 1.4}) for the symbols of the
+    same name. Generated sources are stored on disk under the hash of the
+    text and parameters, so a known expression is loaded without importing
+    sympy at all.
+    """
+    parameters = parameters or {}
+
+    def build_expression():
+
+        from sympy.parsing.sympy_parser import parse_expr
+        return parse_expr(text).subs(parameters)
+
+    sources, expression = _get_cached_sources(
+        [text.strip(), sorted(parameters.items())], build_expression,
+        cache_path)
+
+    return SymbolicFunction(text, sources, expression)
+
+
+def get_jacobian(x_mapping, y_mapping, cache_path=COMPILED_CACHE_PATH):
+    """
+    Partial derivatives ((dx'/dx, dx'/dy), (dy'/dx, dy'/dy)) of parsed
+    mappings as SymbolicFunctions. Derivatives are cached on disk along with
+    the parsed expressions. Raises NotImplementedError if a derivative
+    cannot be evaluated numerically (e.g. the one of floor).
+    """
+    def get_derivative(mapping, symbol):
+
+        def build_expression():
+
+            from sympy import Symbol
+
+            # Arguments are real: derivatives of Abs, sign and the like in
+            # complex ones are left unevaluated and cannot be printed
+            real_symbols = {Symbol(x): Symbol(x, real=True)
+                            for x in ('x', 'y')}
+            return mapping.expression.subs(real_symbols) \
+                .diff(real_symbols[Symbol(symbol)])
+
+        sources, expression = _get_cached_sources(
+            ['real_derivative', mapping.canonical, symbol], build_expression,
+            cache_path)
+
+        return SymbolicFunction(f'd({mapping.text})/d{symbol}', sources,
+                                expression)
+
+    return tuple(tuple(get_derivative(mapping, symbol)
+                       for symbol in ('x', 'y'))
+                 for mapping in (x_mapping, y_mapping))
+
+
+def evaluate_on_arrays(mapping, xs, ys):
+    """
+    Apply `mapping` to arrays of coordinates. Expressions which do not
+    depend on the arguments (e.g. constants) are broadcast to the input
+    shape, so the result always matches `xs`.
+    """
+    return np.broadcast_to(
+        np.asarray(mapping(xs, ys), dtype=np.float64), np.shape(xs))
+
+
+def clear_compiled_cache(cache_path=COMPILED_CACHE_PATH):
+    """
+    Removes the cached sources of expressions and the generated kernels
+    along with their machine code.
+    """
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
+        logging.info(f'Compiled cache at {cache_path} is cleared')
@@ -1,59 +1,229 @@
+import json
 import logging
-from enum import Enum, auto
-from random import random
+from contextlib import ExitStack
+from enum import IntEnum, auto
+from multiprocessing import Pool, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 
 import numpy as np
-from numba import jit
+
+from calculation.model.symbolic_function import evaluate_on_arrays, \
+    get_jacobian
+from calculation.sampling import sample_cells, sample_cells_ragged
+from monitoring.decorators import record_span
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+SYMBOLIC_IMAGE_SAMPLES = 100
+# Upper bound for mapped points held in memory at once
+SYMBOLIC_IMAGE_BATCH_POINTS = 2_000_000
+# Cells are sampled in blocks of about this many points, each with its own
+# random seed, so that batches of whole blocks can be sized to the number of
+# workers without changing the result
+SYMBOLIC_IMAGE_BLOCK_POINTS = 200_000
+# Batches are smaller than the bound above if there would be fewer than this
+# many of them per worker otherwise
+SYMBOLIC_IMAGE_BATCHES_PER_WORKER = 4
+IMAGE_MODES = ('sampling', 'adaptive', 'interval')
+# Adaptive sampling: samples per cell expected to be covered by the image
+ADAPTIVE_SAMPLES_PER_CELL = 8
+ADAPTIVE_MIN_SAMPLES = 4
+# No cell gets more than this many times `image_density` samples
+ADAPTIVE_MAX_SAMPLES_RATIO = 10
+
+_MORTON_MASKS = tuple(np.uint64(mask) for mask in (
+    0x00000000FFFFFFFF,
+    0x0000FFFF0000FFFF,
+    0x00FF00FF00FF00FF,
+    0x0F0F0F0F0F0F0F0F,
+    0x3333333333333333,
+    0x5555555555555555,
+))
+_MORTON_SHIFTS = tuple(np.uint64(shift) for shift in (16, 8, 4, 2, 1))
+
+
+def _spread_bits(values):
+
+    values = values.astype(np.uint64) & _MORTON_MASKS[0]
+    for shift, mask in zip(_MORTON_SHIFTS, _MORTON_MASKS[1:]):
+        values = (values | (values << shift)) & mask
+
+    return values
+
+
+def _compact_bits(values):
+
+    values = values.astype(np.uint64) & _MORTON_MASKS[-1]
+    for shift, mask in zip(reversed(_MORTON_SHIFTS), _MORTON_MASKS[-2::-1]):
+        values = (values | (values >> shift)) & mask
+
+    return values
+
+
+def encode_morton(i, j):
+    """
+    Z-order code of the cell in column `i` and row `j` (counting from the
+    south-west corner). The code of a cell is its parent's code followed by
+    two bits of the quadrant, so that refining a sorted array of codes
+    keeps it sorted.
+    """
+    return (_spread_bits(i) | (_spread_bits(j) << np.uint64(1))) \
+        .astype(np.int64)
+
+
+def decode_morton(codes):
+    return _compact_bits(codes).astype(np.int64), \
+        _compact_bits(codes.astype(np.uint64) >> np.uint64(1)) \
+        .astype(np.int64)
+
+
+def get_codes_bounds(codes, level, area_bounds, cells_by_x, cells_by_y):
+    """
+    Returns an (n, 4) array of (sw_x, sw_y, ne_x, ne_y) rows for the cells
+    with given Morton `codes` at fragmentation `level` of the area split
+    into cells_by_x x cells_by_y cells initially.
+    """
+    sw_x, sw_y, ne_x, ne_y = area_bounds
+    cell_width = (ne_x - sw_x) / (cells_by_x * 2**level)
+    cell_height = (ne_y - sw_y) / (cells_by_y * 2**level)
+    i, j = decode_morton(codes)
+
+    bounds = np.empty((i.size, 4))
+    bounds[:, 0] = sw_x + i * cell_width
+    bounds[:, 1] = sw_y + j * cell_height
+    bounds[:, 2] = bounds[:, 0] + cell_width
+    bounds[:, 3] = bounds[:, 1] + cell_height
+
+    return bounds
+
+
+def _create_shared_array(shape, dtype, stack):
+    """
+    Allocates a process-shared memory block, released along with the
+    ExitStack `stack`; returns a picklable handle for `_attach_array`.
+    """
+    dtype = np.dtype(dtype)
+    block = SharedMemory(create=True,
+                         size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    stack.callback(block.unlink)
+    stack.callback(block.close)
+
+    return block.name, dtype.str, shape
+
 
-@jit(nopython=True)
-def check_point_in_area(x, y,
-                        area_sw_x, area_sw_y, area_ne_x, area_ne_y):
+def _share_array(array, stack):
+    """
+    Copies `array` into process-shared memory, see `_create_shared_array`.
+    """
+    handle = _create_shared_array(array.shape, array.dtype, stack)
+    _attach_array(handle, stack)[...] = array
+
+    return handle
+
+
+def _attach_array(handle, stack):
+    """
+    Array in the shared memory block of `handle`. The block is closed along
+    with `stack`, so the array must not be used after that.
+    """
+    name, dtype, shape = handle
+    block = SharedMemory(name=name)
+    stack.callback(block.close)
+
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+# Per-process state of symbolic image workers: the mappings set by
+# `_initialize_worker` and the arrays of the layer set by `_load_layer`
+_worker_state = {}
+
+
+def _initialize_worker(x_mapping, y_mapping):
+    _worker_state.update(x_mapping=x_mapping, y_mapping=y_mapping,
+                         layer=None, stack=ExitStack())
+
+
+def create_symbolic_image_pool(workers, x_mapping, y_mapping):
+    """
+    Process pool mapping the batches of `fill_symbolic_image`, to be shared
+    by all the layers of a run.
+    """
+    # Workers share the tracker of shared memory blocks if it is running
+    # already, rather than reporting the blocks they attached to as leaked
+    resource_tracker.ensure_running()
 
-    return area_sw_x < x < area_ne_x \
-        and area_sw_y < y < area_ne_y
+    return Pool(workers, initializer=_initialize_worker,
+                initargs=(x_mapping, y_mapping))
 
 
-@jit(nopython=True, fastmath=True)
-def get_cell_number_for_point(x, y,
-                              area_sw_x, area_sw_y, area_ne_x, area_ne_y,
-                              cells_by_x, cells_by_y):
+def _load_layer(layer):
     """
-    Retrieve area's cell number for given point (x, y).
+    Attaches the worker to the shared arrays of `layer`, unless it is the
+    current one already, and releases the ones of the previous layer.
+    """
+    state = _worker_state
+    if state['layer'] == layer['id']:
+        return
+
+    # Arrays are dropped before the memory they point into is closed
+    for key in ('area', 'active', 'offsets', 'edges'):
+        state.pop(key, None)
+    state['stack'].close()
+    stack = state['stack'] = ExitStack()
 
-    Counting up to down and left to right, i.e.
+    area = ZoomableArea(**layer['parameters'])
+    for attribute, value in layer['area_state'].items():
+        setattr(area, attribute, _attach_array(value, stack)
+                if isinstance(value, tuple) else value)
 
-    ________________
-    |    |    |    |
-    |  0 |  1 |  2 |
-    |____|____|____|
-    |    |    |    |
-    |  3 |  4 |  5 |
-    |____|____|____|
+    state.update(layer=layer['id'], area=area,
+                 **{key: _attach_array(layer[key], stack)
+                    for key in ('active', 'offsets', 'edges')})
+
+
+def _map_batch_in_worker(task):
+    """
+    Writes the edges of the active cells [start, stop) of the layer into
+    the shared edges buffer at the offset reserved for the batch and
+    returns their number, so that no point or edge arrays travel through
+    pickling. Edges which don't fit into the reserved part (only possible in
+    the interval mode) are returned as is.
     """
-    if not check_point_in_area(x, y, area_sw_x, area_sw_y, area_ne_x, area_ne_y):
-        return -1
+    layer, start, stop, blocks = task
+    _load_layer(layer)
+    state = _worker_state
 
-    cell_width = (area_ne_x - area_sw_x) / cells_by_x
-    cell_height = (area_ne_y - area_sw_y) / cells_by_y
+    edges = state['area'].get_symbolic_image_edges(
+        state['active'][start:stop], state['x_mapping'], state['y_mapping'],
+        blocks)
 
-    i = np.int32(np.floor((x - area_sw_x) / cell_width))
-    j = np.int32(np.floor((y - area_sw_y) / cell_height))
+    offset = state['offsets'][start]
+    if edges.size > state['offsets'][stop] - offset:
+        return edges
 
-    return (cells_by_y - 1 - j) * cells_by_x + i
+    state['edges'][offset:offset + edges.size] = edges
 
+    return edges.size
 
-class CellStatus(Enum):
+
+class CellStatus(IntEnum):
     ACTIVE = auto()
     DISCARDED = auto()
 
 
 class ZoomableArea:
+    """
+    Rectangular area split into `cells_by_x` x `cells_by_y` cells, each of
+    which is split into 2 x 2 subcells at every regular fragmentation.
+
+    Only the cells of the current fragmentation level are kept, as flat
+    arrays sorted by Morton code; graph nodes are indices into them.
+    """
 
-    def __init__(self, area_bounds, cells_by_x, cells_by_y, id_):
+    def __init__(self, area_bounds, cells_by_x, cells_by_y,
+                 image_density=SYMBOLIC_IMAGE_SAMPLES, sampling_layout='random',
+                 seed=None, image_mode='sampling', incremental=False):
 
         self.sw_x = area_bounds[0]
         self.sw_y = area_bounds[1]
@@ -61,176 +231,657 @@ class ZoomableArea:
         self.ne_y = area_bounds[3]
         self.cells_by_x = cells_by_x
         self.cells_by_y = cells_by_y
-        self.id_ = id_
 
-        self.cell_width = (self.ne_x - self.sw_x) / self.cells_by_x
-        self.cell_height = (self.ne_y - self.sw_y) / self.cells_by_y
-        self.status = CellStatus.ACTIVE
-        self.cluster = 0
+        # Sample points per cell for symbolic image construction
+        self.image_density = image_density
+        self.sampling_layout = sampling_layout
+        self.random_generator = np.random.default_rng(seed)
+        self.image_mode = image_mode
+        self.incremental = incremental
+
+        self.level = 0
+        self.codes = np.empty(0, dtype=np.int64)
+        self.status = np.empty(0, dtype=np.uint8)
+        self.clusters = np.empty(0, dtype=np.int32)
+
+        # Edges between the surviving cells of the previous level as sorted
+        # keys `source * parents_number + target`, where cells are numbered
+        # in the order of their codes
+        self.parent_edges = None
+        self.parents_number = 0
+        self._surviving_edges = None
+
+        # With `count_transitions` set, `fill_symbolic_image` keeps the
+        # number of samples behind every edge as (sources, targets, counts)
+        self.count_transitions = False
+        self.transitions = None
+
+        # Samples of every cell in the adaptive image mode
+        self.sample_counts = None
+
+    @property
+    def cells_number(self):
+        return self.codes.size
+
+    @property
+    def cell_width(self):
+        return (self.ne_x - self.sw_x) / (self.cells_by_x * 2**self.level)
+
+    @property
+    def cell_height(self):
+        return (self.ne_y - self.sw_y) / (self.cells_by_y * 2**self.level)
+
+    @property
+    def parameters(self):
+        """
+        Constructor arguments reproducing this area's geometry and
+        sampling settings.
+        """
+        return {
+            'area_bounds': (self.sw_x, self.sw_y, self.ne_x, self.ne_y),
+            'cells_by_x': self.cells_by_x,
+            'cells_by_y': self.cells_by_y,
+            'image_density': self.image_density,
+            'sampling_layout': self.sampling_layout,
+            'image_mode': self.image_mode,
+            'incremental': self.incremental,
+        }
+
+    def get_state(self):
+        """
+        Arrays describing the current level cells, enough to continue the
+        fragmentation with `set_state` in another process.
+        """
+        state = {
+            'level': np.array(self.level),
+            'codes': self.codes,
+            'status': self.status,
+            'clusters': self.clusters,
+            'random_state': np.array(
+                json.dumps(self.random_generator.bit_generator.state)),
+        }
+
+        if self._surviving_edges is not None:
+            state['surviving_sources'], state['surviving_targets'] = \
+                self._surviving_edges
+
+        return state
+
+    def set_state(self, state):
+
+        self.level = int(state['level'])
+        self.codes = state['codes']
+        self.status = state['status']
+        self.clusters = state['clusters']
+        self.random_generator.bit_generator.state = \
+            json.loads(str(state['random_state']))
+
+        self.parent_edges = None
+        self._surviving_edges = \
+            (state['surviving_sources'], state['surviving_targets']) \
+            if 'surviving_sources' in state else None
+
+    def _reset_cells(self, codes, component_graph):
 
-        self.children = []
+        self.codes = codes
+        self.status = np.full(codes.size, CellStatus.ACTIVE, dtype=np.uint8)
+        self.clusters = np.zeros(codes.size, dtype=np.int32)
 
-        # if we really have a fragmentation
-        if self.cells_by_x != 1 or self.cells_by_y != 1:
-            self._initialize_children()
+        component_graph.add_complex_nodes(range(codes.size))
 
-    def _initialize_children(self):
+    def get_active_cells(self):
+        return np.flatnonzero(self.status == CellStatus.ACTIVE)
 
-        for j in range(self.cells_by_y):
-            for i in range(self.cells_by_x):
+    def get_cell_bounds(self, indices):
+        """
+        Returns an (n, 4) array of (sw_x, sw_y, ne_x, ne_y) rows for the
+        cells with given `indices`.
+        """
+        return get_codes_bounds(self.codes[indices], self.level,
+                                (self.sw_x, self.sw_y, self.ne_x, self.ne_y),
+                                self.cells_by_x, self.cells_by_y)
+
+    def get_snapshot(self):
+        """
+        Compact copy of the current layer: level along with the codes and
+        clusters of the active cells.
+        """
+        return self.get_state_snapshot({
+            'level': self.level,
+            'codes': self.codes,
+            'status': self.status,
+            'clusters': self.clusters,
+        })
+
+    @staticmethod
+    def get_state_snapshot(state):
+        """
+        Snapshot of the layer stored as `state` by `get_state`.
+        """
+        active = state['status'] == CellStatus.ACTIVE
+        return {
+            'level': int(state['level']),
+            'codes': state['codes'][active],
+            'clusters': state['clusters'][active],
+        }
+
+    def get_cells_by_points(self, xs, ys):
+        """
+        Indices of the current level cells containing points (xs, ys);
+        -1 is returned for the points out of bounds or belonging to a cell
+        discarded at one of the previous levels.
 
-                child_area = (
-                    self.sw_x + i * self.cell_width,
-                    self.sw_y + (self.cells_by_y-j-1) * self.cell_height,
-                    self.sw_x + (i+1) * self.cell_width,
-                    self.sw_y + (self.cells_by_y-j) * self.cell_height,
-                )
+        Note: cells DISCARDED at the current level are still found. You
+        should check that case in the wrapping methods.
+        """
+        cells_by_x = self.cells_by_x * 2**self.level
+        cells_by_y = self.cells_by_y * 2**self.level
 
-                child = ZoomableArea(child_area, 1, 1,
-                                     self.id_ + (j*self.cells_by_x + i, ))
-                self.children.append(child)
+        inside = (self.sw_x < xs) & (xs < self.ne_x) \
+            & (self.sw_y < ys) & (ys < self.ne_y)
 
-    def _set_cells_number(self, cells_by_x, cells_by_y):
+        i = np.floor((xs[inside] - self.sw_x) / self.cell_width)
+        j = np.floor((ys[inside] - self.sw_y) / self.cell_height)
+        codes = encode_morton(np.minimum(i, cells_by_x - 1),
+                              np.minimum(j, cells_by_y - 1))
 
-        if self.cells_by_x == 1 and self.cells_by_y == 1:
+        positions = np.minimum(np.searchsorted(self.codes, codes),
+                               self.codes.size - 1)
 
-            if cells_by_x == 1 and cells_by_y == 1:
-                logging.warning('Incorrect values set for either cells_by_x '
-                                f'({cells_by_x}) or cells_by_y ({cells_by_y})')
-                return
+        indices = np.full(np.shape(xs), -1, dtype=np.int64)
+        indices[inside] = np.where(self.codes[positions] == codes,
+                                   positions, -1)
 
-            self.cells_by_x = cells_by_x
-            self.cells_by_y = cells_by_y
-            self.cell_width = (self.ne_x - self.sw_x) / self.cells_by_x
-            self.cell_height = (self.ne_y - self.sw_y) / self.cells_by_y
+        return indices
 
-            self._initialize_children()
+    def get_active_area_points(self, cell_density, general_list,
+                               clusters_list=None):
+        """
+        Appends an (n * cell_density, 2) array of points sampled in the
+        n active cells to `general_list`.
+        """
+        active = self.get_active_cells()
+        xs, ys = sample_cells(self.get_cell_bounds(active), cell_density,
+                              self.random_generator, self.sampling_layout)
 
-    def get_active_area_points(self, cell_density, general_list, clusters_list=None):
+        general_list.append(np.column_stack((xs.ravel(), ys.ravel())))
+        if clusters_list is not None:
+            clusters_list.extend(self.clusters[active].tolist())
 
-        if not self.children and self.status is CellStatus.ACTIVE:
+    def do_initial_fragmentation(self, component_graph):
 
-            area_points = []
-            area_width = self.ne_x - self.sw_x
-            area_height = self.ne_y - self.sw_y
+        with record_span('fragmentation', level=self.level) as span:
+            i, j = np.meshgrid(np.arange(self.cells_by_x),
+                               np.arange(self.cells_by_y))
+            self._reset_cells(np.sort(encode_morton(i.ravel(), j.ravel())),
+                              component_graph)
+            span['cells'] = self.cells_number
 
-            for i in range(cell_density):
-                area_points.append((
-                    self.sw_x + random() * area_width,
-                    self.sw_y + random() * area_height
-                ))
+    def do_regular_fragmentation(self, component_graph):
 
-            general_list += area_points
-            if clusters_list is not None:
-                clusters_list.append(self.cluster)
-        
-        else:
-            for child in self.children:
-                child.get_active_area_points(
-                    cell_density, general_list, clusters_list)
+        with record_span('fragmentation', level=self.level + 1) as span:
 
-    def get_cell_by_id(self, id_):
+            # DISCARDED cells are dropped, all the active ones are split 2 x 2
+            active = self.status == CellStatus.ACTIVE
 
-        parent = self
+            if self._surviving_edges is not None:
+                ranks = np.cumsum(active) - 1
+                sources, targets = self._surviving_edges
+                self.parents_number = int(np.count_nonzero(active))
+                self.parent_edges = np.unique(
+                    ranks[sources] * self.parents_number + ranks[targets])
+                self._surviving_edges = None
 
-        for i in range(len(id_)):
-            if not parent.children:
-                if i < len(id_) - 1:
-                    logging.warning('get_cell_by_id reached end of '
-                                    'fragmentation but `id_` is not over')
-                return parent
+            active_codes = self.codes[active]
+            self.level += 1
+            self._reset_cells(
+                ((active_codes[:, np.newaxis] << 2) | np.arange(4)).ravel(),
+                component_graph)
+            span['cells'] = self.cells_number
 
-            parent = parent.children[id_[i]]
+    def get_symbolic_image_edges(self, cells, x_mapping, y_mapping, blocks):
+        """
+        Returns sorted unique keys `source * cells_number + target` of the
+        symbolic image edges going out of `cells`, built according to the
+        `image_mode` of the area. Sample points of every (start, stop, seed)
+        range of `cells` in `blocks` are drawn with their own random seed.
+        """
+        if self.image_mode == 'interval':
+            return self._get_interval_image_edges(cells, x_mapping, y_mapping)
 
-        return parent
+        return self._get_sampled_image_edges(cells, x_mapping, y_mapping,
+                                             blocks)
 
-    def get_cell_by_point(self, x, y):
+    def _is_connected_by_parents(self, edges):
         """
-        Note: this method returns appropriate ZoomableArea
-        even if that cell is DISCARDED. You should check that
-        case in the wrapping methods.
+        Marks the edges whose source's parent is connected with the
+        target's parent. Children of a surviving cell are the consecutive
+        cells [4 * rank, 4 * rank + 3], so parents are found arithmetically.
         """
-        if not self.children:
-            return self
+        if self.parent_edges.size == 0:
+            return np.zeros(edges.size, dtype=bool)
 
-        cell_number = get_cell_number_for_point(
-            x, y,
-            self.sw_x, self.sw_y, self.ne_x, self.ne_y,
-            self.cells_by_x, self.cells_by_y
-        )
+        parent_keys = edges // self.cells_number // 4 * self.parents_number \
+            + edges % self.cells_number // 4
 
-        if cell_number == -1:
-            logging.warning(f'Given point ({x}, {y}) is out of bounds')
-            return
+        positions = np.minimum(np.searchsorted(self.parent_edges, parent_keys),
+                               self.parent_edges.size - 1)
 
-        child = self.children[cell_number]
-        return child.get_cell_by_point(x, y)
+        return self.parent_edges[positions] == parent_keys
 
-    def do_initial_fragmentation(self, component_graph):
+    def _get_parent_targets_ranges(self, cells):
+        """
+        Ranges [start, stop) of `parent_edges` going out of the parents of
+        `cells`.
+        """
+        parent_keys = cells // 4 * self.parents_number
 
-        # component_graph must be root ZoomableArea
-        for child in self.children:
-            component_graph.add_complex_node(child.id_)
+        return np.searchsorted(self.parent_edges, parent_keys), \
+            np.searchsorted(self.parent_edges,
+                            parent_keys + self.parents_number)
 
-    def do_regular_fragmentation(self, component_graph):
+    def get_sample_counts(self, cells):
+        """
+        Number of sample points of every cell of `cells`: `image_density`,
+        or the `sample_counts` chosen in the adaptive image mode.
+        """
+        if self.image_mode == 'adaptive':
+            return self.sample_counts[cells]
 
-        if not self.children and self.status is CellStatus.ACTIVE:
+        return np.full(cells.size, self.image_density, dtype=np.int64)
 
-            self._set_cells_number(2, 2)
+    def _sample_blocks(self, bounds, counts, blocks):
+        """
+        Flat xs and ys of the samples of cells with given `bounds` and
+        sample `counts`, drawn for every (start, stop, seed) range of cells
+        in `blocks` with its own random generator.
+        """
+        samples = []
+
+        for start, stop, seed in blocks:
+
+            random_generator = np.random.default_rng(seed)
+
+            if self.image_mode == 'adaptive':
+                samples.append(sample_cells_ragged(
+                    bounds[start:stop], counts[start:stop], random_generator,
+                    self.sampling_layout))
+            else:
+                samples.append([x.ravel() for x in sample_cells(
+                    bounds[start:stop], self.image_density, random_generator,
+                    self.sampling_layout)])
+
+        return (np.concatenate(x) for x in zip(*samples))
+
+    def _get_sampled_image_edges(self, cells, x_mapping, y_mapping, blocks):
+        """
+        Maps the sample points of each cell and connects it to the cells
+        hit. The samples of a cell following the first one mapped out of the
+        area or into a discarded cell are not taken into account.
+        """
+        bounds = self.get_cell_bounds(cells)
+        counts = self.get_sample_counts(cells)
+        xs, ys = self._sample_blocks(bounds, counts, blocks)
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            new_xs = evaluate_on_arrays(x_mapping, xs, ys)
+            new_ys = evaluate_on_arrays(y_mapping, xs, ys)
+
+        targets = self.get_cells_by_points(new_xs, new_ys)
+        hit = targets != -1
+        hit[hit] = self.status[targets[hit]] == CellStatus.ACTIVE
+
+        # Cutting off every sample after the first miss within a cell: the
+        # samples of a cell follow each other, so a sample is kept if the
+        # number of misses up to it equals the one at the start of the cell
+        owners = np.repeat(np.arange(cells.size), counts)
+        misses = np.concatenate(([0], np.cumsum(~hit)))
+        starts = np.cumsum(counts) - counts
+        hit = misses[1:] == misses[starts][owners]
+
+        edges = cells[owners[hit]] * self.cells_number + targets[hit]
+
+        # Repeated edges are kept to be counted by `fill_symbolic_image`
+        return np.sort(edges) if self.count_transitions else np.unique(edges)
 
-            for child in self.children:
-                component_graph.add_complex_node(child.id_)
+    def get_adaptive_sample_counts(self, cells, x_mapping, y_mapping):
+        """
+        Samples for every cell of `cells`, proportional to the number of
+        cells its image is expected to cover. The image is estimated by the
+        parallelogram the Jacobian at the cell center maps the cell onto:
+        its area plus its width and height (all in cells) approximate the
+        cells it touches. The total is limited to `image_density` samples
+        per cell on average.
+        """
+        bounds = self.get_cell_bounds(cells)
+        xs = (bounds[:, 0] + bounds[:, 2]) / 2
+        ys = (bounds[:, 1] + bounds[:, 3]) / 2
+
+        with np.errstate(over='ignore', invalid='ignore'):
+
+            (dxx, dxy), (dyx, dyy) = [
+                [evaluate_on_arrays(derivative, xs, ys) for derivative in row]
+                for row in get_jacobian(x_mapping, y_mapping)]
 
-        else:
-            # Even if we have terminated DISCARDED cell as `self`,
-            #  it won't fragment further because of absence of children
-            for child in self.children:
-                child.do_regular_fragmentation(component_graph)
+            aspect = self.cell_height / self.cell_width
+            covered = np.abs(dxx * dyy - dxy * dyx) \
+                + np.abs(dxx) + np.abs(dxy) * aspect \
+                + np.abs(dyx) / aspect + np.abs(dyy) + 1
 
-    def fill_symbolic_image(self, component_graph, x_mapping, y_mapping):
+        # Cells of undefined derivatives get the average number of samples
+        counts = np.where(np.isfinite(covered),
+                          np.ceil(ADAPTIVE_SAMPLES_PER_CELL * covered),
+                          self.image_density)
+        counts = np.clip(counts, ADAPTIVE_MIN_SAMPLES,
+                         ADAPTIVE_MAX_SAMPLES_RATIO * self.image_density)
 
-        for node in component_graph.nodes:
+        budget = self.image_density * cells.size
+        if counts.sum() > budget:
+            counts = np.maximum(np.floor(counts * budget / counts.sum()),
+                                ADAPTIVE_MIN_SAMPLES)
 
-            zoomable_area = self.get_cell_by_id(node)
-            cell_points = []
+        return counts.astype(np.int64)
 
-            zoomable_area.get_active_area_points(100, cell_points, [])
+    def _get_grid_ranges(self, lower, upper, origin, cell_size, cells_number):
 
-            for point in cell_points:
+        with np.errstate(invalid='ignore'):
+            first = np.clip(np.floor((lower - origin) / cell_size),
+                            0, cells_number - 1)
+            last = np.clip(np.floor((upper - origin) / cell_size),
+                           0, cells_number - 1)
 
-                new_x = x_mapping(point[0], point[1])
-                new_y = y_mapping(point[0], point[1])
+        return first.astype(np.int64), last.astype(np.int64)
+
+    def _get_interval_image_edges(self, cells, x_mapping, y_mapping):
+        """
+        Encloses the image of every cell into a box by interval evaluation
+        of the mapping expressions and connects the cell to each active cell
+        the box overlaps. Unlike sampling, no edge can be missed.
+
+        With `incremental` refinement, the image of a cell lies within the
+        enclosure of its parent's image as well, so only the children of the
+        parent's targets are connected to it. These are checked against the
+        box instead of its grid positions whenever there are fewer of them.
+        """
+        # Interval arithmetic walks sympy trees, so it is loaded on demand
+        from calculation.interval_arithmetic import evaluate_interval
+
+        bounds = self.get_cell_bounds(cells)
+        x_interval = bounds[:, 0], bounds[:, 2]
+        y_interval = bounds[:, 1], bounds[:, 3]
+
+        with np.errstate(all='ignore'):
+            x_lower, x_upper = evaluate_interval(
+                x_mapping.expression, x_interval, y_interval)
+            y_lower, y_upper = evaluate_interval(
+                y_mapping.expression, x_interval, y_interval)
+
+        overlaps = (x_upper > self.sw_x) & (x_lower < self.ne_x) \
+            & (y_upper > self.sw_y) & (y_lower < self.ne_y)
+
+        i_first, i_last = self._get_grid_ranges(
+            x_lower, x_upper, self.sw_x, self.cell_width,
+            self.cells_by_x * 2**self.level)
+        j_first, j_last = self._get_grid_ranges(
+            y_lower, y_upper, self.sw_y, self.cell_height,
+            self.cells_by_y * 2**self.level)
 
-                # In this case we do not registrating such link in graph
-                if not check_point_in_area(
-                        new_x, new_y,
-                        self.sw_x, self.sw_y, self.ne_x, self.ne_y):
-                    break
+        widths = i_last - i_first + 1
+        candidates = np.where(overlaps, widths * (j_last - j_first + 1), 0)
 
-                # A cell which contains mapped point
-                remote_cell = self.get_cell_by_point(new_x, new_y)
+        by_parents = np.zeros(cells.size, dtype=bool)
+        if self.parent_edges is not None:
+            targets_start, targets_stop = \
+                self._get_parent_targets_ranges(cells)
+            children_number = 4 * (targets_stop - targets_start)
+            by_parents = overlaps & (children_number < candidates)
+            candidates[by_parents] = children_number[by_parents]
+
+        # Boxes covering more grid positions than there are cells are
+        # matched against every cell instead of enumerating the positions
+        large = ~by_parents & (candidates > self.cells_number)
+        edges = [self._get_large_boxes_edges(
+            cells[large], i_first[large], i_last[large],
+            j_first[large], j_last[large])]
+
+        candidates[large] = 0
+        batch_ends = np.searchsorted(
+            np.cumsum(candidates),
+            np.arange(SYMBOLIC_IMAGE_BATCH_POINTS, candidates.sum(),
+                      SYMBOLIC_IMAGE_BATCH_POINTS))
+
+        for batch in np.split(np.arange(cells.size), batch_ends):
+
+            counts = candidates[batch]
+            owners = np.repeat(batch, counts)
+            positions = np.arange(counts.sum()) \
+                - np.repeat(np.cumsum(counts) - counts, counts)
+
+            targets = np.empty(owners.size, dtype=np.int64)
+            on_grid = ~by_parents[owners]
+
+            grid_owners, grid_positions = owners[on_grid], positions[on_grid]
+            targets[on_grid] = self._find_active_cells(
+                i_first[grid_owners] + grid_positions % widths[grid_owners],
+                j_first[grid_owners] + grid_positions // widths[grid_owners])
+
+            if not on_grid.all():
+
+                # Candidate k of a cell is child k % 4 of the (k // 4)-th
+                # target of its parent
+                parent_owners = owners[~on_grid]
+                parent_positions = positions[~on_grid]
+                children = 4 * (self.parent_edges[
+                    targets_start[parent_owners] + parent_positions // 4]
+                    % self.parents_number) + parent_positions % 4
+
+                i, j = decode_morton(self.codes[children])
+                inside = (self.status[children] == CellStatus.ACTIVE) \
+                    & (i_first[parent_owners] <= i) \
+                    & (i <= i_last[parent_owners]) \
+                    & (j_first[parent_owners] <= j) \
+                    & (j <= j_last[parent_owners])
+                targets[~on_grid] = np.where(inside, children, -1)
+
+            found = targets != -1
+
+            edges.append(cells[owners[found]] * self.cells_number
+                         + targets[found])
+
+        edges = np.unique(np.concatenate(edges))
+
+        # Enclosures of the cells may stick out of the ones of their parents
+        return edges if self.parent_edges is None \
+            else edges[self._is_connected_by_parents(edges)]
+
+    def _get_large_boxes_edges(self, cells, i_first, i_last, j_first, j_last):
+
+        if not cells.size:
+            return np.empty(0, dtype=np.int64)
+
+        i, j = decode_morton(self.codes)
+        active = self.status == CellStatus.ACTIVE
+
+        return np.concatenate([
+            cell * self.cells_number + np.flatnonzero(
+                active & (i_first[k] <= i) & (i <= i_last[k])
+                & (j_first[k] <= j) & (j <= j_last[k]))
+            for k, cell in enumerate(cells)])
+
+    def _find_active_cells(self, i, j):
+
+        codes = encode_morton(i, j)
+        positions = np.minimum(np.searchsorted(self.codes, codes),
+                               self.codes.size - 1)
+
+        found = (self.codes[positions] == codes) \
+            & (self.status[positions] == CellStatus.ACTIVE)
+
+        return np.where(found, positions, -1)
+
+    def _get_edges_in_parallel(self, active, offsets, tasks, x_mapping,
+                               y_mapping, workers, pool):
+
+        with ExitStack() as stack:
+
+            if pool is None:
+                pool = stack.enter_context(create_symbolic_image_pool(
+                    workers, x_mapping, y_mapping))
+
+            shared_edges = _create_shared_array((int(offsets[-1]), ),
+                                                np.int64, stack)
+            layer = {
+                # Workers tell the layers apart by their edge buffers
+                'id': shared_edges[0],
+                'parameters': self.parameters,
+                'area_state': {
+                    'level': self.level,
+                    'codes': _share_array(self.codes, stack),
+                    'status': _share_array(self.status, stack),
+                    'count_transitions': self.count_transitions,
+                    'sample_counts': None if self.sample_counts is None
+                    else _share_array(self.sample_counts, stack),
+                    'parent_edges': None if self.parent_edges is None
+                    else _share_array(self.parent_edges, stack),
+                    'parents_number': self.parents_number,
+                },
+                'active': _share_array(active, stack),
+                'offsets': _share_array(offsets, stack),
+                'edges': shared_edges,
+            }
+
+            counts = pool.map(_map_batch_in_worker,
+                              [(layer, *task) for task in tasks])
+
+            edges = _attach_array(shared_edges, stack)
+            batch_edges = [
+                result if isinstance(result, np.ndarray)
+                else edges[offsets[start]:offsets[start] + result].copy()
+                for (start, _, _), result in zip(tasks, counts)]
+            del edges
+
+        return batch_edges
+
+    @staticmethod
+    def _split_into_batches(offsets, batch_points):
+        """
+        Boundaries of consecutive batches of cells holding up to
+        `batch_points` sample points (but at least one cell), given the
+        offsets of the samples of every cell.
+        """
+        boundaries = [0]
+        while boundaries[-1] < offsets.size - 1:
+            start = boundaries[-1]
+            stop = np.searchsorted(offsets, offsets[start] + batch_points,
+                                   side='right') - 1
+            boundaries.append(max(int(stop), start + 1))
 
-                if remote_cell.status is CellStatus.DISCARDED:
-                    break
+        return boundaries
 
-                component_graph.add_edge_for_complex_nodes(
-                    node,
-                    remote_cell.id_
-                )
+    def _get_tasks(self, offsets, workers):
+        """
+        (start, stop, blocks) batches of the active cells with given sample
+        `offsets`, see `fill_symbolic_image`; blocks are relative to the
+        cells of their batch.
+        """
+        blocks = self._split_into_batches(offsets, SYMBOLIC_IMAGE_BLOCK_POINTS)
+        seeds = self.random_generator.integers(np.iinfo(np.int64).max,
+                                               size=len(blocks) - 1)
+
+        batch_points = int(np.clip(
+            np.ceil(offsets[-1]
+                    / (workers * SYMBOLIC_IMAGE_BATCHES_PER_WORKER)),
+            SYMBOLIC_IMAGE_BLOCK_POINTS, SYMBOLIC_IMAGE_BATCH_POINTS))
+        batches = self._split_into_batches(offsets[blocks], batch_points)
+
+        tasks = []
+        for first, last in zip(batches[:-1], batches[1:]):
+            start = blocks[first]
+            tasks.append((start, blocks[last], [
+                (blocks[i] - start, blocks[i + 1] - start, int(seeds[i]))
+                for i in range(first, last)]))
+
+        return tasks
+
+    def fill_symbolic_image(self, component_graph, x_mapping, y_mapping,
+                            workers=1, pool=None):
+        """
+        Registers the edges of all active cells, processing them in batches
+        of up to SYMBOLIC_IMAGE_BATCH_POINTS sample points, smaller ones if
+        there would be fewer than SYMBOLIC_IMAGE_BATCHES_PER_WORKER batches
+        per worker otherwise. Batches consist of whole blocks of about
+        SYMBOLIC_IMAGE_BLOCK_POINTS samples, each with its own random seed,
+        so the result doesn't depend on `workers`. With several workers, the
+        batches are mapped by `pool` (see `create_symbolic_image_pool`), or
+        by a pool created for this call alone.
+
+        With `count_transitions` set, the number of samples mapped along
+        every edge is stored in `transitions` as well.
+
+        In the adaptive image mode, the number of samples of every cell is
+        chosen by `get_adaptive_sample_counts` first.
+        """
+        active = self.get_active_cells()
+
+        if self.image_mode == 'adaptive':
+            self.sample_counts = np.zeros(self.cells_number, dtype=np.int64)
+            self.sample_counts[active] = self.get_adaptive_sample_counts(
+                active, x_mapping, y_mapping)
+
+        # Offsets of the samples of every active cell; interval images are
+        # batched as if there were `image_density` samples per cell
+        offsets = np.concatenate(([0], np.cumsum(
+            self.get_sample_counts(active))))
+        tasks = self._get_tasks(offsets, workers)
+
+        with record_span('symbolic_image', level=self.level,
+                         cells=int(active.size)) as span:
+
+            if self.image_mode != 'interval':
+                span['sample_points'] = int(offsets[-1])
+
+            if workers > 1 and len(tasks) > 1:
+                batch_edges = self._get_edges_in_parallel(
+                    active, offsets, tasks, x_mapping, y_mapping, workers,
+                    pool)
+            else:
+                batch_edges = [self.get_symbolic_image_edges(
+                    active[start:stop], x_mapping, y_mapping, blocks)
+                    for start, stop, blocks in tasks]
+
+            # Batches cover consecutive sources, so the keys stay sorted
+            edges = np.concatenate(batch_edges) if batch_edges \
+                else np.empty(0, dtype=np.int64)
+
+            if self.count_transitions:
+                edges, counts = np.unique(edges, return_counts=True)
+                self.transitions = (edges // self.cells_number,
+                                    edges % self.cells_number, counts)
+
+            component_graph.add_edge_arrays(edges // self.cells_number,
+                                            edges % self.cells_number)
+            span['edges'] = int(edges.size)
 
     def markup_entire_area(self, component_graph):
 
-        clusters_num = 0
-        component_graph.initialize_strongly_connected_components()
+        with record_span('scc', level=self.level) as span:
+            component_graph.initialize_strongly_connected_components()
+            labels = component_graph.scc_labels
+            sizes = component_graph.scc_sizes
+            span['components'] = int(sizes.size)
+            span['dense_components'] = int(np.count_nonzero(sizes > 1))
+
+        with record_span('markup', level=self.level) as span:
+            in_cluster = sizes[labels] > 1
+            self.clusters[in_cluster] = labels[in_cluster]
+            self.status[~in_cluster] = CellStatus.DISCARDED
 
-        for i, component in enumerate(component_graph.scc_components):
-            for node in component:
+            if self.incremental:
+                sources, targets = component_graph.get_edge_arrays()
+                surviving = in_cluster[sources] & in_cluster[targets]
+                self._surviving_edges = sources[surviving], targets[surviving]
 
-                if len(component) > 1:
-                    self.get_cell_by_id(node).cluster = i
-                    clusters_num += 1
-                else:
-                    self.get_cell_by_id(node).status = CellStatus.DISCARDED
+            span['active_cells'] = int(np.count_nonzero(in_cluster))
 
-        logging.debug(f'{clusters_num}/{len(component_graph.scc_components)} '
-                      'components are clusters')
+        logging.debug(f'{component_graph.dense_components_number}/'
+                      f'{sizes.size} components are clusters')
@@ -0,0 +1,70 @@
+import logging
+import os
+import shutil
+
+from calculation.checkpointing import compute_fingerprint
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DEFAULT_CACHE_PATH = '.cache'
+DEFAULT_CACHE_SIZE = 4 * 2**30
+
+
+def _get_directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+class ResultCache:
+    """
+    On-disk cache of computation results. Every entry is a directory named
+    after the hash of the canonicalized inputs; entries are evicted in the
+    least recently used order once their total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_PATH,
+                 max_bytes=DEFAULT_CACHE_SIZE):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get_entry(self, kind, **parameters):
+        """
+        Returns the directory of the entry for given inputs, creating it if
+        needed and marking it as the most recently used one.
+        """
+        path = os.path.join(self.directory,
+                            compute_fingerprint(kind=kind, **parameters))
+
+        os.makedirs(path, exist_ok=True)
+        os.utime(path)
+
+        return path
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits into
+        `max_bytes`; the entry `keep` is never removed.
+        """
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = [os.path.join(self.directory, x)
+                   for x in os.listdir(self.directory)]
+        entries = sorted(filter(os.path.isdir, entries),
+                         key=os.path.getmtime)
+        sizes = {entry: _get_directory_size(entry) for entry in entries}
+        total_size = sum(sizes.values())
+
+        for entry in entries:
+
+            if total_size <= self.max_bytes:
+                break
+
+            if keep is not None and os.path.samefile(entry, keep):
+                continue
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= sizes[entry]
+            logging.debug(f'Evicted cache entry {entry}')
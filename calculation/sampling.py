@@ -0,0 +1,89 @@
+import numpy as np
+
+SAMPLING_LAYOUTS = ('random', 'stratified', 'halton')
+
+
+def _radical_inverse(indices, base):
+
+    result = np.zeros(indices.size)
+    fraction = 1.0
+    indices = indices.copy()
+
+    while indices.any():
+        fraction /= base
+        result += fraction * (indices % base)
+        indices //= base
+
+    return result
+
+
+def _sample_random(cells_number, count, random_generator):
+    return random_generator.random((cells_number, count, 2))
+
+
+def _sample_stratified(cells_number, count, random_generator):
+    """
+    Latin hypercube per cell: each of `count` rows and columns of the cell
+    holds exactly one point.
+    """
+    strata = np.argsort(random_generator.random((cells_number, count, 2)),
+                        axis=1)
+    return (strata + random_generator.random((cells_number, count, 2))) \
+        / count
+
+
+def _sample_halton(cells_number, count, random_generator):
+    """
+    Halton (2, 3) sequence shared by all the cells, randomly shifted modulo
+    1 within every cell so that cells don't sample identical offsets.
+    """
+    indices = np.arange(1, count + 1)
+    sequence = np.column_stack((_radical_inverse(indices, 2),
+                                _radical_inverse(indices, 3)))
+    shifts = random_generator.random((cells_number, 1, 2))
+
+    return (sequence[np.newaxis] + shifts) % 1.0
+
+
+_SAMPLERS = {
+    'random': _sample_random,
+    'stratified': _sample_stratified,
+    'halton': _sample_halton,
+}
+
+
+def sample_cells(bounds, count, random_generator, layout='random'):
+    """
+    Generates `count` points in every cell of the (n, 4) `bounds` array of
+    (sw_x, sw_y, ne_x, ne_y) rows. Returns xs and ys arrays of shape
+    (n, count).
+    """
+    offsets = _SAMPLERS[layout](bounds.shape[0], count, random_generator)
+
+    xs = bounds[:, [0]] + offsets[..., 0] * (bounds[:, [2]] - bounds[:, [0]])
+    ys = bounds[:, [1]] + offsets[..., 1] * (bounds[:, [3]] - bounds[:, [1]])
+
+    return xs, ys
+
+
+def sample_cells_ragged(bounds, counts, random_generator, layout='random'):
+    """
+    Counterpart of `sample_cells` generating `counts[i]` points in the cell
+    i. Returns flat xs and ys arrays, where the points of every cell follow
+    each other in the order of `bounds`.
+    """
+    starts = np.cumsum(counts) - counts
+    xs = np.empty(counts.sum())
+    ys = np.empty(counts.sum())
+
+    # Cells of equal counts are sampled together, as layouts need a fixed
+    # number of points
+    for count in np.unique(counts):
+
+        cells = np.flatnonzero(counts == count)
+        positions = (starts[cells, np.newaxis] + np.arange(count)).ravel()
+        cell_xs, cell_ys = sample_cells(bounds[cells], count,
+                                        random_generator, layout)
+        xs[positions], ys[positions] = cell_xs.ravel(), cell_ys.ravel()
+
+    return xs, ys
@@ -1,20 +1,165 @@
+import json
 import logging
 import os
-
+import random
+import tracemalloc
+from contextlib import contextmanager
 from cProfile import Profile
 from datetime import datetime
+from functools import wraps
 from io import StringIO
 from pstats import Stats
-from time import time
+from time import perf_counter, process_time, time, time_ns
+
+try:
+    import resource
+except ImportError:
+    # Peak RSS is only reported on Unix-like systems
+    resource = None
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 PROFILE_DUMP_PATH = 'monitoring'
+# Share of calls profiled by `dump_profile`. Full cProfile slows the
+# numba/NumPy hot paths down noticeably, so it is opt-in
+PROFILING_RATE = float(os.environ.get('PROFILING_RATE', 0))
+# Own generator, so that choosing the calls to profile doesn't shift the
+# random stream of the caller
+_profiling_random = random.Random()
+
+# Stage metrics are cheap enough to be kept on, but are only kept in
+# `last_metrics` unless a directory to dump them to as JSON is set
+METRICS_DUMP_PATH = os.environ.get('METRICS_DUMP_PATH')
+METRICS_ENABLED = True
+# tracemalloc gives exact allocation peaks per stage, but slows allocation
+# heavy code down, hence opt-in as well
+TRACE_MEMORY = bool(os.environ.get('TRACE_MEMORY'))
+
+# Stages of the running `record_metrics` call, None outside of it
+_spans = None
+# Metrics of the latest completed `record_metrics` call
+last_metrics = None
+
+
+def _get_peak_rss():
+    """
+    Peak resident set size of the process so far, in MiB. It covers the
+    whole process lifetime, so a stage only raises it above the peaks of
+    everything run before.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, but in bytes on macOS
+    return peak / 2**20 if os.uname().sysname == 'Darwin' else peak / 2**10
+
+
+def _summarize_spans(spans):
+
+    totals = {}
+    for span in spans:
+        total = totals.setdefault(span['name'],
+                                  {'calls': 0, 'wall_time': 0.0,
+                                   'cpu_time': 0.0})
+        total['calls'] += 1
+        total['wall_time'] += span['wall_time']
+        total['cpu_time'] += span['cpu_time']
+
+    return totals
+
+
+@contextmanager
+def record_span(name, **counts):
+    """
+    Records wall time, CPU time and memory peaks of the enclosed stage of
+    the running `record_metrics` call. Counts of processed items (cells,
+    edges, ...) can be passed as keywords or set on the yielded dict. Does
+    nothing but yielding the dict outside of `record_metrics`.
+    """
+    span = {'name': name, **counts}
+
+    if _spans is None:
+        yield span
+        return
+
+    # Traced peaks can only be reset per stage since Python 3.9
+    trace_peak = tracemalloc.is_tracing() and hasattr(tracemalloc,
+                                                      'reset_peak')
+    if trace_peak:
+        tracemalloc.reset_peak()
+
+    wall_start, cpu_start = perf_counter(), process_time()
+    try:
+        yield span
+
+    finally:
+        span['wall_time'] = perf_counter() - wall_start
+        span['cpu_time'] = process_time() - cpu_start
+        span['process_peak_rss_mb'] = _get_peak_rss()
+        if trace_peak:
+            span['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] \
+                / 2**20
+
+        _spans.append(span)
+
+
+def record_metrics(f):
+    """
+    Collects the stages recorded with `record_span` during the call into a
+    structured report, kept in `last_metrics` and dumped as JSON.
+    """
+    @wraps(f)
+    def inner(*args, **kwargs):
+
+        global _spans, last_metrics
+
+        if not METRICS_ENABLED:
+            return f(*args, **kwargs)
+
+        outer_spans, _spans = _spans, []
+        tracing_started = TRACE_MEMORY and not tracemalloc.is_tracing()
+        if tracing_started:
+            tracemalloc.start()
+
+        started_at = datetime.now().isoformat()
+        wall_start, cpu_start = perf_counter(), process_time()
+
+        try:
+            result = f(*args, **kwargs)
+
+        finally:
+            spans, _spans = _spans, outer_spans
+            if tracing_started:
+                tracemalloc.stop()
+
+        last_metrics = {
+            'function': f.__name__,
+            'started_at': started_at,
+            'wall_time': perf_counter() - wall_start,
+            'cpu_time': process_time() - cpu_start,
+            'process_peak_rss_mb': _get_peak_rss(),
+            'totals': _summarize_spans(spans),
+            'stages': spans,
+        }
+
+        if METRICS_DUMP_PATH is not None:
+            os.makedirs(METRICS_DUMP_PATH, exist_ok=True)
+            path = os.path.join(
+                METRICS_DUMP_PATH,
+                f'{time_ns()}-{f.__name__}-{os.getpid()}.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(last_metrics, file, indent=4)
+
+        return result
+
+    return inner
 
 
 def capture_execution_time(f):
 
+    @wraps(f)
     def inner(*args, **kwargs):
 
         logging.debug(f'Capturing execution time for {f.__name__}...')
@@ -29,8 +174,12 @@ def capture_execution_time(f):
 
 def dump_profile(f):
 
+    @wraps(f)
     def inner(*args, **kwargs):
-        
+
+        if _profiling_random.random() >= PROFILING_RATE:
+            return f(*args, **kwargs)
+
         logging.debug(f'Profiling {f.__name__}...')
         profile = Profile()
         profile.enable()
@@ -1,12 +1,19 @@
 import abc
 import json
+import logging
 import os
 import re
 
-from sympy import lambdify
-from sympy.abc import x, y
-from sympy.parsing.sympy_parser import parse_expr
-from sympy.utilities.iterables import iterable
+try:
+    import tomllib
+except ImportError:
+    # TOML settings files are supported on Python 3.11+ only
+    tomllib = None
+
+from calculation.model.symbolic_function import parse_symbolic_function
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 # These settings are considered as default when there is no recent session file
 SETTINGS_BY_MODES = {
@@ -35,6 +42,55 @@ MODE_ID_TO_NAME = {
     SETTINGS_BY_MODES[mode]['@ID']: mode for mode in SETTINGS_BY_MODES
 }
 
+MAPPING_SETTINGS = ('x_mapping', 'y_mapping')
+
+
+def load_settings_file(path):
+    """
+    Reads settings for non-interactive runs from a JSON or TOML file.
+    """
+    if path.endswith('.toml'):
+
+        if tomllib is None:
+            logging.error('TOML settings require Python 3.11 or newer; '
+                          'use a JSON file instead')
+            raise ValueError
+
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+
+    with open(path, encoding=SettingsManager.RECENT_SESSION_ENCODING) as f:
+        return json.load(f)
+
+
+def resolve_mode_settings(mode, overrides, parameters=None):
+    """
+    Settings of `mode` for non-interactive runs: the defaults updated with
+    `overrides`, and mapping expressions parsed with numeric `parameters`
+    substituted. Settings absent from the defaults are kept as they are, so
+    that extra keyword arguments can be passed to the computation.
+    """
+    if mode not in SETTINGS_BY_MODES:
+        logging.error(f'Unknown mode given: {mode}; '
+                      f'pass one of {", ".join(SETTINGS_BY_MODES)}')
+        raise ValueError
+
+    settings = {setting: value for setting, value
+                in {**SETTINGS_BY_MODES[mode], **overrides}.items()
+                if setting != '@ID'}
+
+    for setting in MAPPING_SETTINGS:
+
+        function = parse_symbolic_function(settings[setting], parameters)
+        if set(function.symbols) - {'x', 'y'}:
+            logging.error(f'`{setting}` contains symbols other than x or y '
+                          f'without values given: {function.text}')
+            raise ValueError
+
+        settings[setting] = function
+
+    return settings
+
 
 class SettingsManager(abc.ABC):
 
@@ -58,15 +114,15 @@ class SettingsManager(abc.ABC):
     @staticmethod
     def _parse_two_argument_function(expression: str):
 
-        expr = parse_expr(expression)
-        if any([atom.is_Symbol and atom != x and atom != y
-                for atom in expr.atoms()]):
+        function = parse_symbolic_function(expression)
+        if set(function.symbols) - {'x', 'y'}:
 
             print('Specified expression contains symbols other than x or y: '
-                  f'{expr}, please enter function depending only on x and y')
+                  f'{function.text}, please enter function depending only on '
+                  'x and y')
             return None
 
-        return lambdify([x, y], expr, 'numpy')
+        return function
 
     @staticmethod
     def _parse_comma_delimited_floats(elements_number: int):
@@ -105,7 +161,8 @@ class SettingsManager(abc.ABC):
         while parsed_expression is None:
 
             entered_expression = input(prompt_format_string.format(
-                ', '.join([str(x) for x in default]) if iterable(default)
+                ', '.join([str(x) for x in default])
+                if isinstance(default, (list, tuple))
                 else default))
 
             if entered_expression == '':
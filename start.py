@@ -1,14 +1,20 @@
+import argparse
+import json
 import logging
+import sys
 
-from calculation.arbitrary_mapping import populate_2d_points
-from calculation.cr_set_localizing import condense_connected_components
+from calculation.result_cache import DEFAULT_CACHE_PATH, ResultCache
 from settings.managing import MODE_ID_TO_NAME, SETTINGS_BY_MODES, \
-    ArbitraryMappingSettingsManager, CrSetLocalizingSettingsManager
-from visualization.plotter import compose_scatter_plot
+    ArbitraryMappingSettingsManager, CrSetLocalizingSettingsManager, \
+    load_settings_file
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Modules of the modes, batch running and plotting are imported where they
+# are used: numba, networkx and plotly take a while to load, and each run
+# needs some of them only
+
 
 def retrieve_mode_settings(manager):
 
@@ -16,7 +22,129 @@ def retrieve_mode_settings(manager):
     return manager.retrieve_mode_settings()
 
 
-if __name__ == '__main__':
+def _parse_resolution(expression):
+    try:
+        width, height = map(int, expression.lower().split('x'))
+        return width, height
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Invalid resolution given: {expression}; pass WIDTHxHEIGHT')
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(
+        description='Runs the chosen mode non-interactively; start without '
+                    'arguments to be prompted for the settings instead.')
+    parser.add_argument('--mode', choices=list(SETTINGS_BY_MODES),
+                        help='mode to operate on')
+    parser.add_argument('--settings', metavar='PATH',
+                        help='JSON or TOML file with mode settings')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='override a setting; the value is parsed as '
+                             'JSON where possible')
+    parser.add_argument('--param', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='value of a symbol used in mapping expressions')
+    parser.add_argument('--sweep', action='append', default=[],
+                        metavar='NAME=GRID',
+                        help='parameter grid as start:stop:count or '
+                             'v1,v2,...; grids are combined')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes running the jobs')
+    parser.add_argument('--output-dir', default='output',
+                        help='directory for job outputs and metadata')
+    parser.add_argument('--profile', action='store_true',
+                        help='dump cProfile profiles of all the jobs to '
+                             '`monitoring`')
+    parser.add_argument('--raster', metavar='EXTENSION',
+                        help='also render the points of every job into an '
+                             'image of this format: .png, .pgm or .npy')
+    parser.add_argument('--resolution', type=_parse_resolution,
+                        metavar='WIDTHxHEIGHT',
+                        help='raster size in pixels, 1000x1000 by default')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH,
+                        metavar='DIRECTORY',
+                        help='reuse the results stored in the result cache '
+                             'and store new ones there '
+                             f'(`{DEFAULT_CACHE_PATH}` by default)')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove the cached sources of expressions and '
+                             'the compiled kernels first')
+
+    return parser.parse_args()
+
+
+def _split_assignment(assignment):
+
+    name, separator, value = assignment.partition('=')
+    if not separator:
+        logging.error(f'Invalid assignment given: {assignment}; '
+                      'pass NAME=VALUE instead')
+        raise ValueError
+
+    return name, value
+
+
+def _parse_setting_value(value):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def run_headless(arguments):
+    """
+    Settings are taken from the file first (where `mode`, `parameters` and
+    `sweep` keys are reserved), then overridden by command line flags.
+    """
+    from calculation.batch_running import parse_grid, run_batch
+    from calculation.model.symbolic_function import clear_compiled_cache
+
+    if arguments.clear_cache:
+        clear_compiled_cache()
+        # Clearing the cache is a run on its own
+        if arguments.mode is None and arguments.settings is None:
+            return True
+
+    settings = load_settings_file(arguments.settings) \
+        if arguments.settings else {}
+
+    file_mode = settings.pop('mode', None)
+    mode = arguments.mode or file_mode
+    parameters = {name: float(value) for name, value
+                  in settings.pop('parameters', {}).items()}
+    grids = {name: values if isinstance(values, list)
+             else parse_grid(f'{name}={values}')[1]
+             for name, values in settings.pop('sweep', {}).items()}
+
+    if mode is None:
+        logging.error('No mode given; pass `--mode` or set `mode` in the '
+                      'settings file')
+        raise ValueError
+
+    for assignment in arguments.set:
+        name, value = _split_assignment(assignment)
+        settings[name] = _parse_setting_value(value)
+
+    for assignment in arguments.param:
+        name, value = _split_assignment(assignment)
+        parameters[name] = float(value)
+
+    for specification in arguments.sweep:
+        name, values = parse_grid(specification)
+        grids[name] = values
+
+    results = run_batch(mode, settings, parameters, grids,
+                        arguments.output_dir, arguments.workers,
+                        arguments.profile, arguments.raster,
+                        arguments.resolution, arguments.cache)
+
+    return all(x['status'] == 'ok' for x in results)
+
+
+def run_interactive():
 
     chosen_mode = None
     while not chosen_mode:
@@ -39,29 +167,52 @@ if __name__ == '__main__':
 
     if MODE_ID_TO_NAME[chosen_mode] == 'ARBITRARY_MAPPING':
 
+        from calculation.arbitrary_mapping import populate_2d_points
+        from visualization.plotter import compose_plot
+
         settings = retrieve_mode_settings(ArbitraryMappingSettingsManager())
-        xs, ys = populate_2d_points(
+        points = populate_2d_points(
             settings['x_mapping'],
             settings['y_mapping'],
             settings['start_point'],
-            settings['iterations']
+            settings['iterations'],
+            cache=ResultCache()
         )
 
-        compose_scatter_plot(xs, ys).show()
+        compose_plot(points).show()
 
 
     elif MODE_ID_TO_NAME[chosen_mode] == 'CR_SET_LOCALIZING':
 
+        from calculation.cr_set_localizing import \
+            condense_connected_components
+        from visualization.plotter import compose_cells_plot
+
         settings = retrieve_mode_settings(CrSetLocalizingSettingsManager())
-        xs, ys = condense_connected_components(
+        result = condense_connected_components(
             settings['x_mapping'],
             settings['y_mapping'],
             (*settings['sw_point'], *settings['ne_point']),
             settings['cell_density'],
             settings['depth'],
-            settings['topsort_enabled']
+            settings['topsort_enabled'],
+            cache=ResultCache()
         )
 
-        compose_scatter_plot(xs, ys).show()
+        compose_cells_plot(result).show()
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        try:
+            succeeded = run_headless(parse_arguments())
+        except ValueError:
+            logging.error('Aborting batch run...')
+            succeeded = False
+
+        logging.info('Shutting down...')
+        sys.exit(0 if succeeded else 1)
 
+    run_interactive()
     logging.info('Shutting down...')
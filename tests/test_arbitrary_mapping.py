@@ -0,0 +1,56 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from calculation.arbitrary_mapping import populate_2d_points
+from calculation.compiled_mapping import ORBIT_COMPILATION_THRESHOLD
+from calculation.model import symbolic_function
+from calculation.model.symbolic_function import parse_symbolic_function
+
+
+@pytest.mark.parametrize('x_text, y_text, parameters, start_point', [
+    # Henon map escaping to infinity, then nan
+    ('1 - a*x**2 + y', 'b*x', {'a': 2., 'b': .3}, (.5, .0)),
+    ('log(x) + y', 'x', {}, (.5, .0)),
+    ('1/x', 'y', {}, (.0, .0)),
+])
+def test_short_orbit_matches_compiled_one(x_text, y_text, parameters,
+                                          start_point, tmp_path):
+
+    cache_path = str(tmp_path / 'compiled')
+    x_mapping = parse_symbolic_function(x_text, parameters, cache_path)
+    y_mapping = parse_symbolic_function(y_text, parameters, cache_path)
+
+    short = populate_2d_points(x_mapping, y_mapping, start_point, 1000,
+                               dtype=np.float64)
+    long = populate_2d_points(x_mapping, y_mapping, start_point,
+                              ORBIT_COMPILATION_THRESHOLD, dtype=np.float64)
+
+    assert not np.isfinite(short).all()
+    assert np.array_equal(short, long[:short.shape[0]], equal_nan=True)
+
+
+def test_expression_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(symbolic_function, 'MAX_CACHED_EXPRESSIONS', 3)
+    cache_path = str(tmp_path / 'compiled')
+    directory = tmp_path / 'compiled' / symbolic_function.EXPRESSIONS_DIRECTORY
+
+    def parse(value, last_use):
+
+        parse_symbolic_function('x + a', {'a': value}, cache_path)
+        # Only the file used just now has a recent modification time
+        for path in directory.iterdir():
+            if path.stat().st_mtime > 10**6:
+                os.utime(path, (last_use, last_use))
+
+    for last_use, value in enumerate((0, 1, 2, 0, 3), 1):
+        parse(value, last_use)
+
+    canonicals = {json.loads(x.read_text())['canonical']
+                  for x in directory.iterdir()}
+    assert canonicals == {
+        parse_symbolic_function('x + a', {'a': x}, cache_path).canonical
+        for x in (0, 2, 3)}
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from calculation.cr_set_localizing import condense_connected_components
+from calculation.model.symbolic_function import parse_symbolic_function
+from settings.managing import SETTINGS_BY_MODES
+
+SETTINGS = SETTINGS_BY_MODES['CR_SET_LOCALIZING']
+DEPTH = 3
+
+
+def _localize(cache_path, depth, **kwargs):
+
+    return condense_connected_components(
+        parse_symbolic_function(SETTINGS['x_mapping'], cache_path=cache_path),
+        parse_symbolic_function(SETTINGS['y_mapping'], cache_path=cache_path),
+        (*SETTINGS['sw_point'], *SETTINGS['ne_point']), 4, depth,
+        kwargs.pop('topsort_enabled', False), graph_backend='sparse',
+        seed=7, **kwargs)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'topsort_enabled': True},
+    {'invariant_measure': True},
+    {'image_mode': 'interval', 'incremental': True, 'keep_layers': True},
+])
+def test_resumed_run_matches_uninterrupted_one(options, tmp_path, caplog):
+
+    cache_path = str(tmp_path / 'compiled')
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+
+    expected = _localize(cache_path, DEPTH, **options)
+
+    _localize(cache_path, 1, checkpoint_dir=checkpoint_dir, **options)
+    caplog.clear()
+    resumed = _localize(cache_path, DEPTH, checkpoint_dir=checkpoint_dir,
+                        resume=True, **options)
+
+    assert 'Resuming from' in caplog.text
+
+    expected_arrays, resumed_arrays = expected.to_arrays(), \
+        resumed.to_arrays()
+    assert expected_arrays.keys() == resumed_arrays.keys()
+    for name, array in expected_arrays.items():
+        assert np.array_equal(array, resumed_arrays[name]), name
+
+    assert len(expected.layers) == len(resumed.layers)
+    for expected_layer, resumed_layer in zip(expected.layers,
+                                             resumed.layers):
+        assert np.array_equal(expected_layer['codes'], resumed_layer['codes'])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from calculation.model.component_graph import ComponentGraph
+from calculation.model.sparse_component_graph import SparseComponentGraph
+
+GRAPH_CLASSES = (ComponentGraph, SparseComponentGraph)
+
+
+def _build_random_graph(graph_class, seed):
+
+    random_generator = np.random.default_rng(seed)
+    nodes_number = int(random_generator.integers(1, 300))
+    edges_number = int(random_generator.integers(0, 3 * nodes_number))
+
+    graph = graph_class()
+    graph.add_complex_nodes(range(nodes_number))
+    graph.add_edge_arrays(
+        random_generator.integers(nodes_number, size=edges_number),
+        random_generator.integers(nodes_number, size=edges_number))
+
+    return graph
+
+
+def _get_partition(labels):
+    return {frozenset(np.flatnonzero(labels == x).tolist())
+            for x in np.unique(labels)}
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_backends_find_same_components(seed):
+
+    graph, sparse_graph = (_build_random_graph(x, seed)
+                           for x in GRAPH_CLASSES)
+    graph.initialize_strongly_connected_components()
+    sparse_graph.initialize_strongly_connected_components()
+
+    assert _get_partition(graph.scc_labels) \
+        == _get_partition(sparse_graph.scc_labels)
+    assert np.array_equal(graph.scc_sizes, sparse_graph.scc_sizes)
+    assert graph.dense_components_number \
+        == sparse_graph.dense_components_number
+
+
+@pytest.mark.parametrize('graph_class', GRAPH_CLASSES)
+@pytest.mark.parametrize('seed', range(5))
+def test_condensed_graph_is_sorted_topologically(graph_class, seed):
+
+    condensed = _build_random_graph(graph_class, seed) \
+        .generate_condensed_graph()
+    order = condensed.sort_nodes(as_array=True)
+
+    positions = np.empty_like(order)
+    positions[order] = np.arange(order.size)
+    sources, targets = condensed.get_edge_arrays()
+
+    # Post-order places every component after the ones it leads to
+    assert np.all(positions[sources] > positions[targets])
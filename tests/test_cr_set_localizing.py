@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from calculation.cr_set_localizing import condense_connected_components
+from calculation.model import zoomable_area
+from calculation.model.symbolic_function import parse_symbolic_function
+from calculation.model.zoomable_area import IMAGE_MODES
+
+X_MAPPING = 'y'
+Y_MAPPING = '-x + 2 * sin(x) * cos(y) + .5 * x * y'
+AREA_BOUNDS = (-4., -4., 4., 4.)
+
+
+def _localize(cache_path, **kwargs):
+
+    return condense_connected_components(
+        parse_symbolic_function(X_MAPPING, cache_path=cache_path),
+        parse_symbolic_function(Y_MAPPING, cache_path=cache_path),
+        AREA_BOUNDS, 4, 4, graph_backend='sparse', seed=7, **kwargs)
+
+
+def test_incremental_refinement_keeps_enclosed_cells(tmp_path):
+
+    cache_path = str(tmp_path)
+    expected = _localize(cache_path, image_mode='interval')
+    incremental = _localize(cache_path, image_mode='interval',
+                            incremental=True)
+
+    # Rigorous images of the parents can only cut spurious edges off
+    expected_cells = {tuple(x) for x in expected.to_arrays()['bounds']}
+    incremental_cells = {tuple(x) for x in incremental.to_arrays()['bounds']}
+    assert incremental_cells <= expected_cells
+    assert incremental_cells
+
+
+def test_incremental_refinement_requires_interval_images(tmp_path, caplog):
+
+    assert _localize(str(tmp_path), incremental=True) is None
+    assert 'interval' in caplog.text
+
+
+@pytest.mark.parametrize('image_mode', IMAGE_MODES)
+def test_result_does_not_depend_on_workers(image_mode, tmp_path,
+                                           monkeypatch):
+
+    # Small blocks split every layer into several batches
+    monkeypatch.setattr(zoomable_area, 'SYMBOLIC_IMAGE_BLOCK_POINTS', 5000)
+
+    cache_path = str(tmp_path)
+    expected = _localize(cache_path, image_mode=image_mode).to_arrays()
+    parallel = _localize(cache_path, image_mode=image_mode,
+                         workers=3).to_arrays()
+
+    for name, array in expected.items():
+        assert np.array_equal(array, parallel[name]), name
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from calculation.interval_arithmetic import evaluate_interval
+from calculation.model.symbolic_function import evaluate_on_arrays, \
+    parse_symbolic_function
+from settings.managing import SETTINGS_BY_MODES
+
+EXPRESSIONS = (
+    SETTINGS_BY_MODES['ARBITRARY_MAPPING']['x_mapping'],
+    SETTINGS_BY_MODES['CR_SET_LOCALIZING']['x_mapping'],
+    SETTINGS_BY_MODES['CR_SET_LOCALIZING']['y_mapping'],
+    'x * y - sin(x) * exp(y / 3)',
+    '1 / (x - y) + x**-2',
+    'Abs(x - y) + cos(x * y) - pi',
+    'log(1 + x**2) * sqrt(1 + y**2)',
+    'x**3 - 3 * x * y**2 + y**4',
+)
+BOX_SIZES = (1e-6, 1e-2, 1., 10.)
+BOXES_NUMBER = 200
+SAMPLES_PER_SIDE = 16
+
+
+def _sample_boxes(random_generator, size):
+
+    sw = random_generator.uniform(-5, 5, (BOXES_NUMBER, 2))
+    ne = sw + size * random_generator.uniform(.5, 1, (BOXES_NUMBER, 2))
+
+    # Regular grids include the corners, where the extrema often are
+    offsets = np.linspace(0, 1, SAMPLES_PER_SIDE)
+    u, v = (x.ravel() for x in np.meshgrid(offsets, offsets))
+    xs = sw[:, [0]] + u * (ne[:, [0]] - sw[:, [0]])
+    ys = sw[:, [1]] + v * (ne[:, [1]] - sw[:, [1]])
+
+    return sw, ne, xs, ys
+
+
+@pytest.mark.parametrize('text', EXPRESSIONS)
+@pytest.mark.parametrize('size', BOX_SIZES)
+def test_enclosures_contain_samples(text, size, tmp_path):
+
+    mapping = parse_symbolic_function(text, cache_path=str(tmp_path))
+    sw, ne, xs, ys = _sample_boxes(np.random.default_rng(0), size)
+
+    lower, upper = evaluate_interval(mapping.expression,
+                                     (sw[:, 0], ne[:, 0]),
+                                     (sw[:, 1], ne[:, 1]))
+
+    with np.errstate(all='ignore'):
+        values = evaluate_on_arrays(mapping, xs, ys)
+
+    defined = np.isfinite(values)
+    assert np.all((lower[:, np.newaxis] <= values)[defined])
+    assert np.all((values <= upper[:, np.newaxis])[defined])
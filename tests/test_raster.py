@@ -0,0 +1,126 @@
+import struct
+
+import numpy as np
+import pytest
+
+from visualization.raster import write_gif
+
+
+def _decode_lzw(data, min_code_size):
+    """
+    Reference GIF LZW decoder, written after the specification rather than
+    the encoder.
+    """
+    clear_code = 1 << min_code_size
+    bits = int.from_bytes(data, 'little')
+    position = 0
+
+    code_size = min_code_size + 1
+    table, previous, output = None, None, []
+
+    while True:
+
+        code = bits >> position & (1 << code_size) - 1
+        position += code_size
+
+        if code == clear_code:
+            table = [[x] for x in range(clear_code)] + [None, None]
+            code_size, previous = min_code_size + 1, None
+            continue
+
+        if code == clear_code + 1:
+            return output
+
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) \
+                else table[previous] + [table[previous][0]]
+            table.append(table[previous] + [entry[0]])
+
+            if len(table) == 1 << code_size and code_size < 12:
+                code_size += 1
+
+        output.extend(entry)
+        previous = code
+
+
+def _read_gif(path):
+    """
+    Returns the palette and the frames of a GIF file written by
+    `write_gif`.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    assert data[:6] == b'GIF89a'
+    columns, rows, flags = struct.unpack('<HHB', data[6:11])
+    palette_end = 13 + 3 * 2**((flags & 7) + 1)
+    palette = np.frombuffer(data[13:palette_end], dtype=np.uint8) \
+        .reshape(-1, 3)
+
+    def read_blocks(position):
+
+        blocks = []
+        while data[position]:
+            blocks.append(data[position + 1:position + 1 + data[position]])
+            position += data[position] + 1
+
+        return b''.join(blocks), position + 1
+
+    frames = []
+    position = palette_end
+
+    while data[position] != 0x3B:
+
+        if data[position] == 0x21:
+            # Extensions (looping, frame delays) carry no pixels
+            _, position = read_blocks(position + 2)
+            continue
+
+        assert data[position] == 0x2C
+        min_code_size = data[position + 10]
+        pixels, position = read_blocks(position + 11)
+        frames.append(np.array(_decode_lzw(pixels, min_code_size))
+                      .reshape(rows, columns))
+
+    return palette, frames
+
+
+def _generate_frames(kind, colors_number, resolution, random_generator):
+
+    columns, rows = resolution
+
+    for _ in range(3):
+        if kind == 'noise':
+            yield random_generator.integers(
+                colors_number, size=(rows, columns), dtype=np.uint8)
+        else:
+            # Large runs of few colors, as in renders of cells
+            blocks = random_generator.integers(colors_number, size=(4, 5),
+                                               dtype=np.uint8)
+            yield np.kron(blocks, np.ones((rows // 4 + 1, columns // 5 + 1),
+                                          dtype=np.uint8))[:rows, :columns]
+
+
+@pytest.mark.parametrize('kind', ('noise', 'blocks'))
+@pytest.mark.parametrize('colors_number', (2, 11, 256))
+def test_gif_frames_round_trip(kind, colors_number, tmp_path):
+
+    # Noise of 256 colors fills up the code table, so it is cleared midway
+    resolution = (123, 77)
+    colors = [f'#{x:02X}{255 - x:02X}{x // 2:02X}'
+              for x in range(colors_number)]
+    frames = list(_generate_frames(kind, colors_number, resolution,
+                                   np.random.default_rng(colors_number)))
+
+    path = tmp_path / 'frames.gif'
+    write_gif(str(path), frames, resolution, colors)
+    palette, decoded = _read_gif(path)
+
+    assert len(decoded) == len(frames)
+    for frame, decoded_frame in zip(frames, decoded):
+        assert np.array_equal(frame, decoded_frame)
+
+    assert [f'#{r:02X}{g:02X}{b:02X}' for r, g, b
+            in palette[:colors_number]] == colors
@@ -0,0 +1,47 @@
+import numpy as np
+
+from calculation.model.zoomable_area import decode_morton, encode_morton, \
+    get_codes_bounds
+
+MAX_INDEX = 2**31 - 1
+
+
+def test_morton_codes_round_trip():
+
+    random_generator = np.random.default_rng(0)
+    i = np.concatenate(([0, MAX_INDEX, 0, MAX_INDEX],
+                        random_generator.integers(MAX_INDEX, size=10000)))
+    j = np.concatenate(([0, 0, MAX_INDEX, MAX_INDEX],
+                        random_generator.integers(MAX_INDEX, size=10000)))
+
+    decoded_i, decoded_j = decode_morton(encode_morton(i, j))
+
+    assert np.array_equal(decoded_i, i)
+    assert np.array_equal(decoded_j, j)
+
+
+def test_morton_children_follow_parent():
+
+    random_generator = np.random.default_rng(1)
+    i, j = random_generator.integers(2**20, size=(2, 1000))
+    codes = encode_morton(i, j)
+
+    for quadrant in range(4):
+        child_i, child_j = decode_morton((codes << 2) | quadrant)
+        assert np.array_equal(child_i, 2 * i + (quadrant & 1))
+        assert np.array_equal(child_j, 2 * j + (quadrant >> 1))
+
+
+def test_codes_bounds_tile_the_area():
+
+    area_bounds = (-2., -1., 2., 1.)
+    level = 3
+    i, j = np.meshgrid(np.arange(4 * 2**level), np.arange(2 * 2**level))
+    codes = np.sort(encode_morton(i.ravel(), j.ravel()))
+
+    bounds = get_codes_bounds(codes, level, area_bounds, 4, 2)
+    areas = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+
+    assert np.isclose(areas.sum(), 8.)
+    assert np.allclose(bounds.min(axis=0)[:2], area_bounds[:2])
+    assert np.allclose(bounds.max(axis=0)[2:], area_bounds[2:])
@@ -1,17 +1,54 @@
 import numpy as np
 import plotly.graph_objects as go
+from numba import njit
+
+from calculation.model.localization_result import UNRANKED
+from visualization.raster import BACKGROUND_COLOR, CLUSTER_COLORS, \
+    DEFAULT_RESOLUTION, \
+    compute_density, get_bounds, locate_pixels, render_cell_indices
 
 DEFAULT_COLOR = '#ED823D'
+# Larger point sets are shown as a density heatmap in the automatic mode
+SCATTER_POINTS_LIMIT = 1_000_000
+RENDER_MODES = ('auto', 'scatter', 'density', 'decimated')
+ANIMATION_RESOLUTION = (500, 500)
+
+
+@njit(cache=True)
+def _select_first_in_pixels(pixels, taken):
+
+    selected = np.zeros(pixels.shape[0], dtype=np.bool_)
+    for k in range(pixels.shape[0]):
+        if pixels[k] >= 0 and not taken[pixels[k]]:
+            taken[pixels[k]] = True
+            selected[k] = True
+
+    return selected
+
 
+def decimate_points(points, bounds=None, resolution=DEFAULT_RESOLUTION):
+    """
+    Keeps the first point of every pixel of `resolution` over the visible
+    `bounds`, so that at most columns * rows points are returned however
+    long the orbit is, and none of the visible structure is lost.
+    """
+    bounds = bounds or get_bounds(points)
+    columns, rows = resolution
 
-def compose_scatter_plot(x_values, y_values):
+    selected = _select_first_in_pixels(
+        locate_pixels(points, bounds, resolution),
+        np.zeros(columns * rows, dtype=np.bool_))
 
-    assert x_values.size == y_values.size
-    size = x_values.size
+    return np.asarray(points[selected])
+
+
+def compose_scatter_plot(points):
+
+    assert points.ndim == 2 and points.shape[1] == 2
 
     return go.Figure(data=go.Scattergl(
-        x = x_values,
-        y = y_values,
+        x = points[:, 0],
+        y = points[:, 1],
         mode='markers',
         marker={
             'color': DEFAULT_COLOR,
@@ -20,3 +57,197 @@ def compose_scatter_plot(x_values, y_values):
             'size': 2,
         }
     ))
+
+
+def compose_density_plot(points, bounds=None, resolution=DEFAULT_RESOLUTION,
+                         log_scale=True):
+    """
+    Heatmap of point density; its size depends on the `resolution` only.
+    Log scaling keeps sparse regions visible next to dense attractor cores.
+    """
+    assert points.ndim == 2 and points.shape[1] == 2
+
+    counts, (sw_x, sw_y, ne_x, ne_y) = compute_density(points, bounds,
+                                                      resolution)
+    columns, rows = resolution
+
+    # Empty pixels are left transparent
+    z = np.where(counts > 0, np.log1p(counts) if log_scale else counts,
+                 np.nan)
+
+    return go.Figure(data=go.Heatmap(
+        z=z,
+        x0=sw_x + (ne_x - sw_x) / columns / 2,
+        dx=(ne_x - sw_x) / columns,
+        y0=sw_y + (ne_y - sw_y) / rows / 2,
+        dy=(ne_y - sw_y) / rows,
+        colorscale='Viridis',
+        colorbar={'title': 'log(1 + count)' if log_scale else 'count'},
+    ))
+
+
+def compose_decimated_plot(points, resolution=DEFAULT_RESOLUTION,
+                           zoomable=False):
+    """
+    Scatter plot of the points decimated to one per pixel. A `zoomable`
+    plot is a FigureWidget (requires ipywidgets, e.g. in Jupyter) which
+    decimates the points again for the visible range after every zoom, so
+    details reappear as the view narrows.
+    """
+    assert points.ndim == 2 and points.shape[1] == 2
+
+    figure = compose_scatter_plot(decimate_points(points,
+                                                  resolution=resolution))
+    if not zoomable:
+        return figure
+
+    figure = go.FigureWidget(figure)
+
+    def redecimate(layout, x_range, y_range):
+
+        if x_range is None or y_range is None:
+            return
+
+        visible = decimate_points(
+            points, (min(x_range), min(y_range), max(x_range), max(y_range)),
+            resolution)
+
+        with figure.batch_update():
+            figure.data[0].x = visible[:, 0]
+            figure.data[0].y = visible[:, 1]
+
+    figure.layout.on_change(redecimate, 'xaxis.range', 'yaxis.range')
+    return figure
+
+
+def _get_rectangles_outline(bounds):
+    """
+    Closed outlines of (n, 4) rectangles as xs and ys of one polyline, with
+    NaN gaps separating the rectangles.
+    """
+    xs = bounds[:, [0, 2, 2, 0, 0, 0]]
+    ys = bounds[:, [1, 1, 3, 3, 1, 1]]
+    xs[:, -1] = ys[:, -1] = np.nan
+
+    return xs.ravel(), ys.ravel()
+
+
+def compose_cells_plot(result):
+    """
+    Draws the cells of a LocalizationResult as filled rectangles, one trace
+    (and one color) per strongly connected component. No points are sampled,
+    so the plot size depends on the number of cells only.
+    """
+    figure = go.Figure()
+
+    for cluster in np.unique(result.clusters):
+
+        in_cluster = result.clusters == cluster
+        xs, ys = _get_rectangles_outline(result.bounds[in_cluster])
+        rank = result.ranks[in_cluster][0]
+        color = CLUSTER_COLORS[cluster % len(CLUSTER_COLORS)]
+
+        figure.add_trace(go.Scattergl(
+            x=xs,
+            y=ys,
+            mode='lines',
+            fill='toself',
+            fillcolor=color,
+            line={'color': color, 'width': 0},
+            name=f'SCC {cluster}' + (f' (rank {rank})'
+                                     if rank != UNRANKED else ''),
+        ))
+
+    return figure
+
+
+def _get_layer_heatmap(result, index, resolution):
+
+    sw_x, sw_y, ne_x, ne_y = result.geometry['area_bounds']
+    columns, rows = resolution
+    colors = (*CLUSTER_COLORS, BACKGROUND_COLOR)
+
+    # Discrete colorscale: every index, the background one included, gets
+    # a band of its own color
+    colorscale = [[position / len(colors), color]
+                  for i, color in enumerate(colors)
+                  for position in (i, i + 1)]
+
+    return go.Heatmap(
+        # Rendered south row first, as heatmaps are drawn upwards
+        z=np.flipud(render_cell_indices(*result.get_layer_cells(index),
+                                        result.geometry['area_bounds'],
+                                        resolution)),
+        x0=sw_x + (ne_x - sw_x) / columns / 2,
+        dx=(ne_x - sw_x) / columns,
+        y0=sw_y + (ne_y - sw_y) / rows / 2,
+        dy=(ne_y - sw_y) / rows,
+        zmin=-0.5,
+        zmax=len(colors) - 0.5,
+        colorscale=colorscale,
+        showscale=False,
+    )
+
+
+def iterate_layer_frames(result, resolution=ANIMATION_RESOLUTION):
+    """
+    Yields one Plotly frame per layer snapshot of a LocalizationResult.
+    Every frame is a fixed `resolution` raster of the layer cells, so its
+    size doesn't grow with the depth.
+    """
+    for i, layer in enumerate(result.layers):
+        yield go.Frame(data=[_get_layer_heatmap(result, i, resolution)],
+                       name=str(layer['level']))
+
+
+def compose_layers_animation(result, resolution=ANIMATION_RESOLUTION,
+                             frame_duration=1000):
+    """
+    Animated figure of the layer-by-layer refinement, requires a result of
+    `condense_connected_components` run with `keep_layers`. For GIF output
+    without a browser see `visualization.raster.save_layers_gif`.
+    """
+    assert result.layers, 'Layer snapshots were not kept'
+
+    frames = list(iterate_layer_frames(result, resolution))
+    levels = [frame.name for frame in frames]
+    animation_settings = {
+        'frame': {'duration': frame_duration, 'redraw': True},
+        'mode': 'immediate',
+    }
+
+    return go.Figure(
+        data=frames[0].data,
+        frames=frames,
+        layout={
+            'yaxis': {'scaleanchor': 'x'},
+            'updatemenus': [{
+                'type': 'buttons',
+                'buttons': [{'label': 'Play', 'method': 'animate',
+                             'args': [None, animation_settings]}],
+            }],
+            'sliders': [{
+                'currentvalue': {'prefix': 'Layer '},
+                'steps': [{'label': level, 'method': 'animate',
+                           'args': [[level], animation_settings]}
+                          for level in levels],
+            }],
+        },
+    )
+
+
+def compose_plot(points, render_mode='auto', **kwargs):
+    """
+    Plot of `points` in one of RENDER_MODES. The automatic mode keeps exact
+    scatter plots for moderate sizes and switches to the density heatmap
+    beyond SCATTER_POINTS_LIMIT points, so the plot size stays bounded.
+    """
+    if render_mode == 'auto':
+        render_mode = 'scatter' if points.shape[0] <= SCATTER_POINTS_LIMIT \
+            else 'density'
+
+    return {
+        'scatter': compose_scatter_plot,
+        'density': compose_density_plot,
+        'decimated': compose_decimated_plot,
+    }[render_mode](points, **kwargs)
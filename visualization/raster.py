@@ -0,0 +1,472 @@
+import logging
+import struct
+import zlib
+
+import numpy as np
+from numba import njit
+
+DEFAULT_RESOLUTION = (1000, 1000)
+BACKGROUND_COLOR = '#FFFFFF'
+DENSITY_COLOR = '#ED823D'
+# Plotly's default qualitative palette, so that rasters match the plots
+CLUSTER_COLORS = ('#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A',
+                  '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52')
+RASTER_FORMATS = ('.png', '.pgm', '.npy')
+# Frame delay of animations, in hundredths of a second
+DEFAULT_FRAME_DELAY = 100
+GIF_MAX_CODE_SIZE = 12
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+@njit(cache=True)
+def _find_bounds(points):
+
+    sw_x, sw_y, ne_x, ne_y = np.inf, np.inf, -np.inf, -np.inf
+    for k in range(points.shape[0]):
+
+        x, y = points[k, 0], points[k, 1]
+        if np.isfinite(x) and np.isfinite(y):
+            sw_x, ne_x = min(sw_x, x), max(ne_x, x)
+            sw_y, ne_y = min(sw_y, y), max(ne_y, y)
+
+    return sw_x, sw_y, ne_x, ne_y
+
+
+@njit(cache=True)
+def _get_pixel(x, y, sw_x, sw_y, ne_x, ne_y, columns, rows):
+
+    # NaN coordinates fail the comparisons as well
+    if not (sw_x <= x <= ne_x and sw_y <= y <= ne_y):
+        return -1
+
+    # Points lying exactly on the north-east border belong to the last pixel
+    i = min(int((x - sw_x) / (ne_x - sw_x) * columns), columns - 1)
+    j = min(int((y - sw_y) / (ne_y - sw_y) * rows), rows - 1)
+
+    return j * columns + i
+
+
+@njit(cache=True)
+def _locate_pixels(points, sw_x, sw_y, ne_x, ne_y, columns, rows):
+
+    pixels = np.empty(points.shape[0], dtype=np.int64)
+    for k in range(points.shape[0]):
+        pixels[k] = _get_pixel(points[k, 0], points[k, 1],
+                               sw_x, sw_y, ne_x, ne_y, columns, rows)
+
+    return pixels
+
+
+@njit(cache=True)
+def _accumulate_density(points, sw_x, sw_y, ne_x, ne_y, columns, rows,
+                        counts):
+
+    for k in range(points.shape[0]):
+        pixel = _get_pixel(points[k, 0], points[k, 1],
+                           sw_x, sw_y, ne_x, ne_y, columns, rows)
+        if pixel >= 0:
+            counts[pixel] += 1
+
+
+@njit(cache=True)
+def _accumulate_labels(points, labels, sw_x, sw_y, ne_x, ne_y, columns,
+                       rows, pixel_labels):
+
+    for k in range(points.shape[0]):
+        pixel = _get_pixel(points[k, 0], points[k, 1],
+                           sw_x, sw_y, ne_x, ne_y, columns, rows)
+        # The smallest label wins, i.e. the largest component for labels
+        # sorted by component size
+        if pixel >= 0 and (pixel_labels[pixel] < 0
+                           or labels[k] < pixel_labels[pixel]):
+            pixel_labels[pixel] = labels[k]
+
+
+@njit(cache=True)
+def _fill_cells(cell_bounds, labels, sw_x, sw_y, ne_x, ne_y, columns, rows,
+                pixel_labels):
+
+    x_scale, y_scale = columns / (ne_x - sw_x), rows / (ne_y - sw_y)
+
+    for k in range(cell_bounds.shape[0]):
+
+        # Every cell covers at least one pixel, however small it is
+        i_first = max(int((cell_bounds[k, 0] - sw_x) * x_scale), 0)
+        i_last = min(max(int(np.ceil((cell_bounds[k, 2] - sw_x) * x_scale)),
+                         i_first + 1), columns)
+        j_first = max(int((cell_bounds[k, 1] - sw_y) * y_scale), 0)
+        j_last = min(max(int(np.ceil((cell_bounds[k, 3] - sw_y) * y_scale)),
+                         j_first + 1), rows)
+
+        for j in range(j_first, j_last):
+            for i in range(i_first, i_last):
+                pixel = j * columns + i
+                if pixel_labels[pixel] < 0 or labels[k] < pixel_labels[pixel]:
+                    pixel_labels[pixel] = labels[k]
+
+
+@njit(cache=True)
+def _emit_code(output, position, buffer, bits, code, code_size):
+
+    # GIF packs codes starting from the least significant bits
+    buffer |= code << bits
+    bits += code_size
+    while bits >= 8:
+        output[position] = buffer & 0xFF
+        position += 1
+        buffer >>= 8
+        bits -= 8
+
+    return position, buffer, bits
+
+
+@njit(cache=True)
+def _encode_lzw(indices, min_code_size):
+    """
+    Variable-length LZW compression of a flat array of color indices as
+    defined by the GIF specification. The dictionary is a (code, color)
+    table of following codes, small for the short palettes used here.
+    """
+    clear_code = 1 << min_code_size
+    max_codes = 1 << GIF_MAX_CODE_SIZE
+
+    following = np.full((max_codes, clear_code), -1, dtype=np.int32)
+    # The entries added since the last clear, to reset them quickly
+    added_prefixes = np.empty(max_codes, dtype=np.int64)
+    added_colors = np.empty(max_codes, dtype=np.int64)
+
+    output = np.empty(2 * indices.size + 16, dtype=np.uint8)
+    position, buffer, bits = 0, 0, 0
+
+    code_size = min_code_size + 1
+    next_code = clear_code + 2
+    position, buffer, bits = _emit_code(output, position, buffer, bits,
+                                        clear_code, code_size)
+    prefix = indices[0]
+
+    for k in range(1, indices.size):
+
+        color = indices[k]
+        if following[prefix, color] >= 0:
+            prefix = following[prefix, color]
+            continue
+
+        position, buffer, bits = _emit_code(output, position, buffer, bits,
+                                            prefix, code_size)
+
+        if next_code < max_codes:
+            following[prefix, color] = next_code
+            added_prefixes[next_code], added_colors[next_code] = prefix, color
+            next_code += 1
+            if next_code > 1 << code_size and code_size < GIF_MAX_CODE_SIZE:
+                code_size += 1
+
+        else:
+            position, buffer, bits = _emit_code(output, position, buffer,
+                                                bits, clear_code, code_size)
+            for code in range(clear_code + 2, next_code):
+                following[added_prefixes[code], added_colors[code]] = -1
+
+            code_size = min_code_size + 1
+            next_code = clear_code + 2
+
+        prefix = color
+
+    position, buffer, bits = _emit_code(output, position, buffer, bits,
+                                        prefix, code_size)
+    position, buffer, bits = _emit_code(output, position, buffer, bits,
+                                        clear_code + 1, code_size)
+    if bits > 0:
+        output[position] = buffer & 0xFF
+        position += 1
+
+    return output[:position]
+
+
+def get_bounds(points):
+    """
+    Extent (sw_x, sw_y, ne_x, ne_y) of the finite points of an (n, 2) array.
+    """
+    sw_x, sw_y, ne_x, ne_y = _find_bounds(points)
+    if not np.isfinite([sw_x, sw_y]).all():
+        return 0.0, 0.0, 1.0, 1.0
+
+    # Avoiding zero-sized pixels for degenerate (e.g. fixed point) sets
+    return sw_x, sw_y, ne_x if ne_x > sw_x else sw_x + 1.0, \
+        ne_y if ne_y > sw_y else sw_y + 1.0
+
+
+def locate_pixels(points, bounds, resolution=DEFAULT_RESOLUTION):
+    """
+    Flat (row-major, south row first) pixel index of every point within
+    `bounds` on the `resolution` (columns, rows) grid, -1 for the rest.
+    """
+    return _locate_pixels(points, *map(float, bounds), *resolution)
+
+
+def compute_density(points, bounds=None, resolution=DEFAULT_RESOLUTION):
+    """
+    Bins (n, 2) `points` into a histogram of `resolution` (columns, rows)
+    pixels over (sw_x, sw_y, ne_x, ne_y) `bounds`, the extent of finite
+    points by default. Returns the (rows, columns) counts array, south row
+    first, and bounds. Memory use doesn't depend on the number of points.
+    """
+    bounds = bounds or get_bounds(points)
+    columns, rows = resolution
+    counts = np.zeros(columns * rows, dtype=np.int64)
+
+    _accumulate_density(points, *map(float, bounds), columns, rows, counts)
+
+    return counts.reshape(rows, columns), bounds
+
+
+def _parse_color(color):
+    return np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)],
+                    dtype=np.float64)
+
+
+def render_density(points, bounds=None, resolution=DEFAULT_RESOLUTION,
+                   log_scale=True):
+    """
+    Grayscale (rows, columns) uint8 image of point density, north row first;
+    black stands for the densest pixels.
+    """
+    counts, _ = compute_density(points, bounds, resolution)
+    values = np.log1p(counts) if log_scale else counts.astype(np.float64)
+    peak = values.max()
+
+    intensity = values / peak if peak > 0 else values
+    return np.flipud(np.round(255 * (1 - intensity))).astype(np.uint8)
+
+
+def colorize_density(image, color=DENSITY_COLOR,
+                     background=BACKGROUND_COLOR):
+    """
+    Maps a grayscale density image to RGB between `background` for empty
+    pixels and `color` for the densest ones.
+    """
+    weights = (1 - image.astype(np.float64) / 255)[..., np.newaxis]
+    rgb = _parse_color(background) * (1 - weights) \
+        + _parse_color(color) * weights
+
+    return np.round(rgb).astype(np.uint8)
+
+
+def render_clusters(points, labels, bounds=None,
+                    resolution=DEFAULT_RESOLUTION, colors=CLUSTER_COLORS,
+                    background=BACKGROUND_COLOR):
+    """
+    RGB (rows, columns, 3) uint8 image, north row first, with every pixel
+    colored after the cluster `labels` (non-negative ints aligned with
+    `points`) of the points falling into it.
+    """
+    bounds = bounds or get_bounds(points)
+    columns, rows = resolution
+    pixel_labels = np.full(columns * rows, -1, dtype=np.int64)
+
+    _accumulate_labels(points, np.asarray(labels, dtype=np.int64),
+                       *map(float, bounds), columns, rows, pixel_labels)
+
+    return _colorize_labels(pixel_labels, resolution, colors, background)
+
+
+def render_cells(cell_bounds, labels, bounds=None,
+                 resolution=DEFAULT_RESOLUTION, colors=CLUSTER_COLORS,
+                 background=BACKGROUND_COLOR):
+    """
+    RGB (rows, columns, 3) uint8 image, north row first, of the (n, 4)
+    `cell_bounds` rectangles filled with the colors of their cluster
+    `labels`. `bounds` default to the extent of the cells.
+    """
+    return _colorize_labels(
+        _get_cell_labels(cell_bounds, labels, bounds, resolution),
+        resolution, colors, background)
+
+
+def _get_cell_labels(cell_bounds, labels, bounds, resolution):
+
+    if bounds is None:
+        bounds = (*cell_bounds[:, :2].min(axis=0),
+                  *cell_bounds[:, 2:].max(axis=0)) if cell_bounds.size \
+            else (0.0, 0.0, 1.0, 1.0)
+
+    columns, rows = resolution
+    pixel_labels = np.full(columns * rows, -1, dtype=np.int64)
+
+    _fill_cells(np.asarray(cell_bounds, dtype=np.float64),
+                np.asarray(labels, dtype=np.int64), *map(float, bounds),
+                columns, rows, pixel_labels)
+
+    return pixel_labels
+
+
+def render_cell_indices(cell_bounds, labels, bounds=None,
+                        resolution=DEFAULT_RESOLUTION, colors_number=None):
+    """
+    Like `render_cells`, but returns the (rows, columns) uint8 image of
+    palette indices: label modulo `colors_number` (len(CLUSTER_COLORS) by
+    default) for cells, `colors_number` for the background.
+    """
+    colors_number = colors_number or len(CLUSTER_COLORS)
+    columns, rows = resolution
+    pixel_labels = _get_cell_labels(cell_bounds, labels, bounds, resolution)
+
+    indices = np.where(pixel_labels >= 0, pixel_labels % colors_number,
+                       colors_number)
+    return np.flipud(indices.astype(np.uint8).reshape(rows, columns))
+
+
+def _colorize_labels(pixel_labels, resolution, colors, background):
+
+    columns, rows = resolution
+    palette = np.vstack([_parse_color(x) for x in colors]
+                        + [_parse_color(background)]).astype(np.uint8)
+    # Empty pixels (-1) take the background, the last palette entry
+    indices = np.where(pixel_labels >= 0, pixel_labels % len(colors), -1)
+
+    return np.flipud(palette[indices].reshape(rows, columns, 3))
+
+
+def _write_png_chunk(f, chunk_type, data):
+
+    f.write(struct.pack('>I', len(data)))
+    f.write(chunk_type + data)
+    f.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+def write_png(path, image):
+    """
+    Writes an 8-bit grayscale (rows, columns) or RGB (rows, columns, 3)
+    image as PNG.
+    """
+    rows, columns = image.shape[:2]
+    color_type = 2 if image.ndim == 3 else 0
+
+    # Every scanline is prefixed with the filter type, 0 (none)
+    scanlines = np.hstack((np.zeros((rows, 1), dtype=np.uint8),
+                           image.reshape(rows, -1)))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _write_png_chunk(f, b'IHDR', struct.pack(
+            '>IIBBBBB', columns, rows, 8, color_type, 0, 0, 0))
+        _write_png_chunk(f, b'IDAT', zlib.compress(scanlines.tobytes(), 6))
+        _write_png_chunk(f, b'IEND', b'')
+
+
+def write_pgm(path, image):
+    """
+    Writes an 8-bit grayscale (rows, columns) image as binary PGM.
+    """
+    rows, columns = image.shape
+
+    with open(path, 'wb') as f:
+        f.write(f'P5\n{columns} {rows}\n255\n'.encode('ascii'))
+        f.write(np.ascontiguousarray(image).tobytes())
+
+
+def _get_raster_format(path):
+
+    extension = path[path.rfind('.'):].lower()
+    if extension not in RASTER_FORMATS:
+        logging.error(f'Unsupported raster format: {extension}; '
+                      f'use one of {", ".join(RASTER_FORMATS)}')
+        raise ValueError
+
+    return extension
+
+
+def _write_image(path, extension, image):
+
+    # PGM is grayscale only, colors are converted to luminance
+    if extension == '.pgm' and image.ndim == 3:
+        image = np.round(image @ [0.299, 0.587, 0.114]).astype(np.uint8)
+
+    {
+        '.png': write_png,
+        '.pgm': write_pgm,
+        '.npy': np.save,
+    }[extension](path, image)
+
+
+def write_gif(path, frames, resolution, colors, delay=DEFAULT_FRAME_DELAY):
+    """
+    Writes a looped GIF animation of `frames`, an iterable of (rows,
+    columns) uint8 arrays of indices into up to 256 `colors`. Frames are
+    consumed and compressed one by one, so they can be generated lazily.
+    """
+    columns, rows = resolution
+    table_bits = max(1, int(np.ceil(np.log2(len(colors)))))
+    palette = np.zeros((2**table_bits, 3), dtype=np.uint8)
+    palette[:len(colors)] = [_parse_color(x) for x in colors]
+    min_code_size = max(2, table_bits)
+
+    with open(path, 'wb') as f:
+
+        f.write(b'GIF89a')
+        f.write(struct.pack('<HHBBB', columns, rows,
+                            0x80 | 0x70 | (table_bits - 1), 0, 0))
+        f.write(palette.tobytes())
+        # Application extension making the animation loop forever
+        f.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+        for frame in frames:
+
+            f.write(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, 0, delay, 0, 0))
+            f.write(struct.pack('<BHHHHB', 0x2C, 0, 0, columns, rows, 0))
+            f.write(bytes([min_code_size]))
+
+            data = _encode_lzw(np.ascontiguousarray(frame).ravel()
+                               .astype(np.int64), min_code_size).tobytes()
+            for start in range(0, len(data), 255):
+                block = data[start:start + 255]
+                f.write(bytes([len(block)]) + block)
+            f.write(b'\x00')
+
+        f.write(b'\x3B')
+
+
+def save_layers_gif(path, result, resolution=DEFAULT_RESOLUTION,
+                    delay=DEFAULT_FRAME_DELAY):
+    """
+    Animates the layer snapshots of a LocalizationResult, one frame per
+    layer. Every frame is rendered only when it is written.
+    """
+    frames = (render_cell_indices(*result.get_layer_cells(i),
+                                  result.geometry['area_bounds'], resolution)
+              for i in range(len(result.layers)))
+
+    write_gif(path, frames, resolution, [*CLUSTER_COLORS, BACKGROUND_COLOR],
+              delay)
+
+
+def save_raster(path, points, labels=None, bounds=None,
+                resolution=DEFAULT_RESOLUTION, log_scale=True):
+    """
+    Rasterizes `points` into the file of one of RASTER_FORMATS, chosen by
+    the extension of `path`. With cluster `labels` given, PNG and NumPy
+    images are colored per cluster; otherwise they show point density.
+    """
+    extension = _get_raster_format(path)
+
+    if extension == '.pgm' or labels is None:
+        image = render_density(points, bounds, resolution, log_scale)
+        if extension != '.pgm':
+            image = colorize_density(image)
+    else:
+        image = render_clusters(points, labels, bounds, resolution)
+
+    _write_image(path, extension, image)
+
+
+def save_cells_raster(path, cell_bounds, labels, bounds=None,
+                      resolution=DEFAULT_RESOLUTION):
+    """
+    Rasterizes cell rectangles colored per cluster `labels` into the file of
+    one of RASTER_FORMATS, chosen by the extension of `path`.
+    """
+    extension = _get_raster_format(path)
+    _write_image(path, extension,
+                 render_cells(cell_bounds, labels, bounds, resolution))